@@ -0,0 +1,130 @@
+import os
+import json
+import shutil
+import hashlib
+import numpy as np
+
+# folder that holds one sub folder of .npy files per cached session
+cache_dir = os.path.join(os.path.expanduser('~'), '.snlab_cache')
+
+# maximum number of bytes the cache may use before old entries are evicted
+cache_budget = 20 * 1024 ** 3
+
+# set to False to always process from the raw tiff files
+enabled = True
+
+
+def session_key(paths, params):
+    """
+    Returns: hex digest identifying a set of raw files and the parameters used to process them
+
+    Parameter paths: pathnames of the raw files of the session
+    Precondition: paths must be a list of Strings
+
+    Parameter params: processing parameters that change the processed output
+    Precondition: params must be a dict that can be written as json
+    """
+    files = []
+    for path in sorted(paths):
+        # any change to a file's name, size or modification time invalidates the entry
+        stat = os.stat(path)
+        files.append([os.path.basename(path), stat.st_size, stat.st_mtime_ns])
+
+    description = json.dumps({'files': files, 'params': params}, sort_keys=True)
+
+    return hashlib.sha1(description.encode()).hexdigest()
+
+
+def load(key, name):
+    """
+    Returns: the cached array memory mapped read-only, or None if it is not in the cache
+
+    Parameter key: the session key from session_key
+    Precondition: key must be a String
+
+    Parameter name: the name of the array within the session
+    Precondition: name must be a String
+    """
+    if not enabled:
+        return None
+
+    path = os.path.join(cache_dir, key, name + '.npy')
+    if not os.path.exists(path):
+        return None
+
+    # mark the entry as recently used
+    os.utime(os.path.join(cache_dir, key))
+
+    return np.load(path, mmap_mode='r')
+
+
+def store(key, name, array):
+    """
+    Writes an array to the cache and evicts old entries if the cache is over budget
+
+    Parameter key: the session key from session_key
+    Precondition: key must be a String
+
+    Parameter name: the name of the array within the session
+    Precondition: name must be a String
+
+    Parameter array: the processed data to cache
+    Precondition: array must be a numpy array
+    """
+    if not enabled:
+        return
+
+    entry = os.path.join(cache_dir, key)
+    os.makedirs(entry, exist_ok=True)
+
+    # write to a temporary file first so a crash never leaves a partial array behind
+    path = os.path.join(entry, name + '.npy')
+    with open(path + '.tmp', 'wb') as f:
+        np.save(f, array)
+    os.replace(path + '.tmp', path)
+
+    os.utime(entry)
+
+    evict(cache_budget)
+
+
+def entry_size(entry):
+    """
+    Returns: total size in bytes of the files in a cache entry
+
+    Parameter entry: the folder of the cache entry
+    Precondition: entry must be a String
+    """
+    return sum(os.path.getsize(os.path.join(entry, f)) for f in os.listdir(entry))
+
+
+def evict(budget):
+    """
+    Deletes least recently used entries until the cache fits within the budget
+
+    Parameter budget: the maximum number of bytes to keep
+    Precondition: budget must be an int
+    """
+    if not os.path.isdir(cache_dir):
+        return
+
+    entries = [os.path.join(cache_dir, key) for key in os.listdir(cache_dir)]
+    entries = [entry for entry in entries if os.path.isdir(entry)]
+
+    # oldest use first
+    entries.sort(key=os.path.getmtime)
+    sizes = [entry_size(entry) for entry in entries]
+    total = sum(sizes)
+
+    for entry, size in zip(entries, sizes):
+        if total <= budget:
+            break
+        shutil.rmtree(entry, ignore_errors=True)
+        total -= size
+
+
+def clear():
+    """
+    Deletes every cached entry
+    """
+    shutil.rmtree(cache_dir, ignore_errors=True)
@@ -0,0 +1,188 @@
+import os
+import re
+import json
+import datetime
+import numpy as np
+
+# folder holding one .npy file per noise baseline and the index describing them
+library_dir = os.path.join(os.path.expanduser('~'), '.snlab_baselines')
+
+# name of the index file inside library_dir
+index_name = 'library.json'
+
+
+def make_key(rig, objective, date=None):
+    """
+    Returns: tuple (rig, objective, date) with surrounding spaces removed and the date as
+    YYYY-MM-DD
+
+    Raises ValueError if rig or objective is empty or the date is not a valid YYYY-MM-DD date
+
+    Parameter rig: name of the microscope rig
+    Precondition: rig must be a String
+
+    Parameter objective: name of the objective
+    Precondition: objective must be a String
+
+    Parameter date: day the baseline was recorded (defaults to today)
+    Precondition: date must be None, a String or a datetime.date
+    """
+    rig, objective = rig.strip(), objective.strip()
+    if not rig or not objective:
+        raise ValueError('a noise baseline needs a rig and an objective')
+
+    if date is None or date == '':
+        date = datetime.date.today()
+    elif not isinstance(date, datetime.date):
+        try:
+            date = datetime.date.fromisoformat(date.strip())
+        except ValueError:
+            raise ValueError('dates must be written YYYY-MM-DD, not ' + repr(date))
+
+    return rig, objective, date.isoformat()
+
+
+def file_name(rig, objective, date):
+    """
+    Returns: name of the .npy file of a baseline, with anything unsafe in a file name replaced
+
+    Parameter rig: name of the microscope rig
+    Precondition: rig must be a String
+
+    Parameter objective: name of the objective
+    Precondition: objective must be a String
+
+    Parameter date: day the baseline was recorded as YYYY-MM-DD
+    Precondition: date must be a String
+    """
+    return '__'.join(re.sub(r'[^A-Za-z0-9.-]+', '_', part)
+                     for part in (rig, objective, date)) + '.npy'
+
+
+def entries():
+    """
+    Returns: list of dicts describing every baseline in the library ('rig', 'objective',
+    'date', 'file', 'shape', 'source' and 'recorded'), oldest date first
+    """
+    path = os.path.join(library_dir, index_name)
+    if not os.path.exists(path):
+        return []
+
+    with open(path) as f:
+        index = json.load(f)
+
+    return sorted(index, key=lambda entry: (entry['rig'], entry['objective'], entry['date']))
+
+
+def write_entries(index):
+    """
+    Writes the index of the library
+
+    Parameter index: every baseline in the library
+    Precondition: index must be a list of dicts returned by entries
+    """
+    path = os.path.join(library_dir, index_name)
+
+    # write to a temporary file first so readers never see a partial index
+    with open(path + '.tmp', 'w') as f:
+        json.dump(index, f, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def record(baseline, rig, objective, date=None, source=None):
+    """
+    Stores a noise baseline as a binary array, replacing any baseline with the same rig,
+    objective and date
+
+    Returns: the dict describing the stored baseline
+
+    Parameter baseline: line averaged noise of every channel, e.g. from
+    TiffProcessor.baseline on a recording without signal
+    Precondition: baseline must be a numpy array with one row of values per channel
+
+    Parameter rig: name of the microscope rig
+    Precondition: rig must be a String
+
+    Parameter objective: name of the objective
+    Precondition: objective must be a String
+
+    Parameter date: day the baseline was recorded (defaults to today)
+    Precondition: date must be None, a String or a datetime.date
+
+    Parameter source: folder the baseline was computed from, kept for reference
+    Precondition: source must be None or a String
+    """
+    rig, objective, date = make_key(rig, objective, date)
+    name = file_name(rig, objective, date)
+    os.makedirs(library_dir, exist_ok=True)
+
+    baseline = np.asarray(baseline)
+    with open(os.path.join(library_dir, name + '.tmp'), 'wb') as f:
+        np.save(f, baseline)
+    os.replace(os.path.join(library_dir, name + '.tmp'), os.path.join(library_dir, name))
+
+    entry = {'rig': rig, 'objective': objective, 'date': date, 'file': name,
+             'shape': list(baseline.shape), 'source': source,
+             'recorded': datetime.datetime.now().isoformat(timespec='seconds')}
+
+    index = [other for other in entries() if other['file'] != name]
+    index.append(entry)
+    write_entries(index)
+
+    return entry
+
+
+def find(rig, objective, date=None):
+    """
+    Returns: the dict describing the latest baseline of a rig and objective recorded on or
+    before date, or None if there is none
+
+    Parameter rig: name of the microscope rig
+    Precondition: rig must be a String
+
+    Parameter objective: name of the objective
+    Precondition: objective must be a String
+
+    Parameter date: day of the recording to correct (defaults to today)
+    Precondition: date must be None, a String or a datetime.date
+    """
+    rig, objective, date = make_key(rig, objective, date)
+
+    # dates are YYYY-MM-DD, so they compare in the same order as text
+    matches = [entry for entry in entries() if entry['rig'] == rig
+               and entry['objective'] == objective and entry['date'] <= date]
+
+    return matches[-1] if matches else None
+
+
+def read(entry):
+    """
+    Returns: the baseline an entry describes, memory mapped read-only
+
+    Parameter entry: a baseline of the library
+    Precondition: entry must be a dict returned by find or entries
+    """
+    return np.load(os.path.join(library_dir, entry['file']), mmap_mode='r')
+
+
+def load(rig, objective, date=None):
+    """
+    Returns: the latest baseline of a rig and objective recorded on or before date
+
+    Raises KeyError if the library has no such baseline
+
+    Parameter rig: name of the microscope rig
+    Precondition: rig must be a String
+
+    Parameter objective: name of the objective
+    Precondition: objective must be a String
+
+    Parameter date: day of the recording to correct (defaults to today)
+    Precondition: date must be None, a String or a datetime.date
+    """
+    entry = find(rig, objective, date)
+    if entry is None:
+        raise KeyError('no noise baseline for rig %s, objective %s on or before %s'
+                       % make_key(rig, objective, date))
+
+    return read(entry)
@@ -0,0 +1,298 @@
+"""
+Headless batch processing of many recording sessions.
+
+Example:
+    python BatchRunner.py --glob '/data/2023-06-*/tiffs' --output /data/results --workers 4
+    python BatchRunner.py --session /data/day1/tiffs /data/day1/vs.mat --output /data/results
+    python BatchRunner.py --glob '/data/*/tiffs' --output /data/results --dtype float32
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+# draw figures without a display; must happen before pyplot is imported
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import matplotlib.pyplot as plt
+import TiffProcessor as tp
+import Grapher as g
+import ExperimentStore as es
+import FigureExport as fe
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+def find_metadata(tiff_dir):
+    """
+    Returns: pathname of the metadata .mat file for a tiff folder, looked for in the folder
+    itself and then in its parent, or None if there is none
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+    """
+    for folder in (tiff_dir, os.path.dirname(os.path.abspath(tiff_dir))):
+        matches = sorted(glob.glob(os.path.join(folder, '*.mat')))
+        if matches:
+            return matches[0]
+
+    return None
+
+
+def collect_sessions(sessions, patterns):
+    """
+    Returns: list of (tiff_dir, metadata_dir) pairs from explicit pairs and glob patterns,
+    each tiff folder once; an explicit pair wins over a glob match of the same folder
+
+    Parameter sessions: explicit [tiff_dir, metadata_dir] pairs
+    Precondition: sessions must be a list of lists of two Strings
+
+    Parameter patterns: glob patterns matching tiff folders
+    Precondition: patterns must be a list of Strings
+    """
+    pairs = [tuple(session) for session in sessions]
+
+    for pattern in patterns:
+        for tiff_dir in sorted(glob.glob(pattern)):
+            if not os.path.isdir(tiff_dir):
+                continue
+            metadata_dir = find_metadata(tiff_dir)
+            if metadata_dir is None:
+                print('skipping ' + tiff_dir + ': no metadata .mat file found')
+                continue
+            pairs.append((tiff_dir.rstrip('/'), metadata_dir))
+
+    # a folder listed twice would be processed twice at once into the same output folder
+    unique_pairs = []
+    seen = set()
+    for tiff_dir, metadata_dir in pairs:
+        folder = os.path.abspath(tiff_dir)
+        if folder not in seen:
+            seen.add(folder)
+            unique_pairs.append((tiff_dir, metadata_dir))
+
+    return unique_pairs
+
+
+def session_names(pairs):
+    """
+    Returns: list with a unique output name for each session: the tiff folder's name, or
+    its parent folder's name + '_' + its name when several sessions share a folder name
+
+    Parameter pairs: (tiff_dir, metadata_dir) pairs to process
+    Precondition: pairs must be a list of tuples of two Strings
+    """
+    names = [os.path.basename(os.path.normpath(tiff_dir)) for tiff_dir, _ in pairs]
+
+    unique_names = []
+    for name, (tiff_dir, _) in zip(names, pairs):
+        if names.count(name) > 1:
+            parent = os.path.basename(os.path.dirname(os.path.abspath(tiff_dir)))
+            name = parent + '_' + name
+        unique_names.append(name)
+
+    return unique_names
+
+
+def peak_memory():
+    """
+    Returns: peak resident memory of this process in bytes, or None if it is not available
+    """
+    if resource is None:
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # macOS reports bytes, Linux kilobytes
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def process_session(name, tiff_dir, metadata_dir, output_dir, analyses, ingest_workers,
+                    memory_budget=None, dtype='float64'):
+    """
+    Runs the analyses for one session, saves the results and figures, and measures it.
+    Runs in a fresh worker process so the peak memory belongs to this session only.
+
+    Returns: dict with the session name, status, runtime in seconds and peak memory in bytes
+
+    Parameter name: name of the session, used for its output folder and figure titles
+    Precondition: name must be a String
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+
+    Parameter metadata_dir: filepath name for the metadata file
+    Precondition: metadata_dir must be a String
+
+    Parameter output_dir: folder to write the results of all sessions to
+    Precondition: output_dir must be a String
+
+    Parameter analyses: names of the analyses to run ('run_all', 'photon_count')
+    Precondition: analyses must be a list of Strings
+
+    Parameter ingest_workers: worker processes used to ingest this session's trials
+    Precondition: ingest_workers must be an int >= 1
+
+    Parameter memory_budget: bytes processing may use before trials are spilled to disk
+    Precondition: memory_budget must be None or an int
+
+    Parameter dtype: float dtype to process in; float32 halves the memory of the trials
+    Precondition: dtype must be 'float64' or 'float32'
+    """
+    session_dir = os.path.join(output_dir, name)
+    os.makedirs(session_dir, exist_ok=True)
+
+    start = time.perf_counter()
+    report = {'session': name, 'tiff_dir': tiff_dir, 'metadata_dir': metadata_dir}
+
+    try:
+        tp.num_workers = ingest_workers
+        tp.memory_budget = memory_budget
+        tp.working_dtype = np.dtype(dtype).type
+
+        # figures go to the session's own folder, titled with the session name
+        g.filepath = session_dir + '/'
+        values = {"-GRAPH_TITLE-": name}
+        store = os.path.join(session_dir, name)
+
+        if 'run_all' in analyses:
+            trial_data, data_average, std_data, baseline_data = tp.run_all(tiff_dir,
+                                                                           metadata_dir)
+            es.add(store, {'trials': trial_data,
+                           'averages': baseline_data.reshape(4, -1),
+                           'std': std_data.reshape(4, -1)})
+
+            g.plot_std(data_average, std_data, values=values)
+            g.plot_data(baseline_data, values=values, type=2)
+
+            plt.close('all')
+
+            # one chart per 10 trials, drawn in this process since sessions already run in a pool
+            fe.export_trial_charts(trial_data, values, workers=1)
+
+        if 'photon_count' in analyses:
+            es.add(store, {'photon_counts': tp.photon_count(tiff_dir, metadata_dir)})
+
+        report['status'] = 'ok'
+    except Exception as error:
+        report['status'] = 'failed'
+        report['error'] = repr(error)
+
+    report['runtime_s'] = time.perf_counter() - start
+    report['peak_memory_bytes'] = peak_memory()
+
+    return report
+
+
+def run_batch(pairs, output_dir, analyses, workers, ingest_workers=1, memory_budget=None,
+              dtype='float64'):
+    """
+    Processes sessions on a pool of worker processes, one fresh process per session
+
+    Returns: list of per-session report dicts, in the order of pairs
+
+    Parameter pairs: (tiff_dir, metadata_dir) pairs to process
+    Precondition: pairs must be a list of tuples of two Strings
+
+    Parameter output_dir: folder to write results to
+    Precondition: output_dir must be a String
+
+    Parameter analyses: names of the analyses to run ('run_all', 'photon_count')
+    Precondition: analyses must be a list of Strings
+
+    Parameter workers: number of sessions processed at the same time
+    Precondition: workers must be an int >= 1
+
+    Parameter ingest_workers: worker processes used inside each session
+    Precondition: ingest_workers must be an int >= 1
+
+    Parameter memory_budget: bytes each session may use before trials are spilled to disk
+    Precondition: memory_budget must be None or an int
+
+    Parameter dtype: float dtype to process in; float32 halves the memory of the trials
+    Precondition: dtype must be 'float64' or 'float32'
+    """
+    os.makedirs(output_dir, exist_ok=True)
+
+    with ProcessPoolExecutor(max_workers=workers, max_tasks_per_child=1) as pool:
+        jobs = [pool.submit(process_session, name, tiff_dir, metadata_dir, output_dir, analyses,
+                            ingest_workers, memory_budget, dtype)
+                for name, (tiff_dir, metadata_dir) in zip(session_names(pairs), pairs)]
+
+        reports = []
+        for job in jobs:
+            report = job.result()
+            print_report_line(report)
+            reports.append(report)
+
+    return reports
+
+
+def print_report_line(report):
+    """
+    Prints one line of the summary for a finished session
+
+    Parameter report: the report of the session
+    Precondition: report must be a dict returned by process_session
+    """
+    peak = report['peak_memory_bytes']
+    peak = 'n/a' if peak is None else '%.0f MB' % (peak / 1024 ** 2)
+
+    print('%-40s %-7s %8.1f s %10s %s' % (report['session'], report['status'],
+                                          report['runtime_s'], peak, report.get('error', '')))
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+    parser = argparse.ArgumentParser(description='Process many sessions without the GUI.')
+    parser.add_argument('--session', nargs=2, action='append', default=[],
+                        metavar=('TIFF_DIR', 'METADATA'), help='a tiff folder and its .mat file')
+    parser.add_argument('--glob', action='append', default=[], metavar='PATTERN',
+                        help='glob of tiff folders; the .mat file is taken from the folder or '
+                             'its parent')
+    parser.add_argument('--output', required=True, help='folder to write results to')
+    parser.add_argument('--analyses', nargs='+', default=['run_all', 'photon_count'],
+                        choices=['run_all', 'photon_count'])
+    parser.add_argument('--workers', type=int, default=os.cpu_count(),
+                        help='sessions processed at the same time')
+    parser.add_argument('--ingest-workers', type=int, default=1,
+                        help='worker processes used to ingest each session')
+    parser.add_argument('--memory-budget', type=float, metavar='GB',
+                        help='memory each session may use before trials are spilled to disk')
+    parser.add_argument('--dtype', default='float64', choices=['float64', 'float32'],
+                        help='float type to process in; float32 halves memory use')
+    parser.add_argument('--report', help='json summary file (default: OUTPUT/batch_report.json)')
+    args = parser.parse_args(argv)
+
+    pairs = collect_sessions(args.session, args.glob)
+    if not pairs:
+        parser.error('no sessions to process')
+
+    start = time.perf_counter()
+    memory_budget = None if args.memory_budget is None else int(args.memory_budget * 1024 ** 3)
+    reports = run_batch(pairs, args.output, args.analyses, args.workers, args.ingest_workers,
+                        memory_budget, args.dtype)
+    total = time.perf_counter() - start
+
+    failed = [report for report in reports if report['status'] != 'ok']
+    print('%d sessions in %.1f s, %d failed' % (len(reports), total, len(failed)))
+
+    report_path = args.report or os.path.join(args.output, 'batch_report.json')
+    with open(report_path, 'w') as f:
+        json.dump({'total_runtime_s': total, 'sessions': reports}, f, indent=2)
+
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
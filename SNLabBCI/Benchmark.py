@@ -0,0 +1,362 @@
+"""
+Benchmarks every TiffProcessor stage on synthetic sessions, so performance can be measured
+without the lab's raw data.
+
+Example:
+    python Benchmark.py --trials 10 40 --size 64x64 256x256 --output bench_v2.json
+    python Benchmark.py --trials 10 --compare bench_v1.json --output bench_v2.json
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+
+# draw figures without a display; must happen before pyplot is imported
+import matplotlib
+matplotlib.use('Agg')
+
+import numpy as np
+import scipy.io
+from PIL import Image
+import TiffProcessor as tp
+import ArrayCache as ac
+import Prefetch as pf
+
+# orientations shown by the synthetic protocol
+angles = (0, 45, 90, 135)
+
+# frames per channel in a synthetic trial (21 frames x 256 lines is one 5376-line trial)
+frames = 21
+
+# every stage that is timed, in the order it runs
+stages = ['tif_processor_run', 'average_line', 'average_trials', 'standard_deviation',
+          'run_all', 'photon_count', 'pca']
+
+
+def synthetic_trial(rng, angle, num_frames, lines, pixels):
+    """
+    Returns: 3D numpy array of uint16 (frames, lines, pixels) as the microscope writes it:
+    the 4 channels interleaved frame by frame and every odd line scanned backwards
+
+    Parameter rng: the random generator
+    Precondition: rng must be a numpy Generator
+
+    Parameter angle: orientation of the trial in degrees
+    Precondition: angle must be a number
+
+    Parameter num_frames: frames per channel
+    Precondition: num_frames must be an int > 0
+
+    Parameter lines: lines per frame
+    Precondition: lines must be an int > 0
+
+    Parameter pixels: pixels per line
+    Precondition: pixels must be an int > 0
+    """
+    # each channel has its own dark level and responds most to its own preferred angle
+    dark = np.array([400, 300, 350, 250]).reshape(1, 4, 1, 1)
+    preferred = np.radians(np.array([0, 45, 90, 135]))
+    gain = 1 + np.cos(2 * (np.radians(angle) - preferred)).reshape(1, 4, 1, 1)
+
+    # slow response rising over the trial, plus shot noise around it
+    time_course = np.linspace(0, 1, num_frames * lines).reshape(num_frames, 1, lines, 1)
+    signal = dark + 200 * gain * time_course
+    trial = rng.poisson(np.broadcast_to(signal, (num_frames, 4, lines, pixels)))
+
+    # rare bright samples the photon counter should pick up
+    photons = rng.random(trial.shape) < 0.001
+    trial[photons] += rng.integers(2000, 8000, size=np.count_nonzero(photons))
+
+    # zig-zag scanning: odd lines are written right to left
+    trial[:, :, 1::2] = trial[:, :, 1::2, ::-1]
+
+    # interleave the channels frame by frame
+    return np.clip(trial, 0, 65535).astype(np.uint16).reshape(num_frames * 4, lines, pixels)
+
+
+def write_tiff(path, stack):
+    """
+    Writes a stack as an uncompressed multi-page 16-bit tif file
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+
+    Parameter stack: the pages to write
+    Precondition: stack must be a 3D numpy array of uint16 (pages, lines, pixels)
+    """
+    pages = [Image.fromarray(page) for page in stack]
+    pages[0].save(path, save_all=True, append_images=pages[1:])
+
+
+def write_metadata(path, trial_angles):
+    """
+    Writes a vs metadata MAT file listing every trial's file # and angle the way
+    MetadataReader reads it (column 0 file #, column 16 angle)
+
+    Parameter path: pathname for the metadata file
+    Precondition: path must be a String
+
+    Parameter trial_angles: the angle of each trial in acquisition order
+    Precondition: trial_angles must be a 1D numpy array
+    """
+    protocol = np.zeros((np.size(trial_angles), 32))
+    protocol[:, 0] = np.arange(1, np.size(trial_angles) + 1)
+    protocol[:, 16] = trial_angles
+
+    scipy.io.savemat(path, {'vs': {'name': 'synthetic', 'version': 1, 'trials': protocol}})
+
+
+def generate_session(folder, num_trials, num_frames, lines, pixels, seed=0):
+    """
+    Writes a synthetic session: one tif file per trial and its metadata file
+
+    Returns: tuple of the tiff folder and the metadata pathname
+
+    Parameter folder: folder to write the session to
+    Precondition: folder must be a String
+
+    Parameter num_trials: number of trials
+    Precondition: num_trials must be an int > 0
+
+    Parameter num_frames: frames per channel
+    Precondition: num_frames must be an int > 0
+
+    Parameter lines: lines per frame
+    Precondition: lines must be an int > 0
+
+    Parameter pixels: pixels per line
+    Precondition: pixels must be an int > 0
+
+    Parameter seed: seed of the random generator, so sessions are the same between runs
+    Precondition: seed must be an int
+    """
+    rng = np.random.default_rng(seed)
+    tiff_dir = os.path.join(folder, 'tiffs')
+    os.makedirs(tiff_dir, exist_ok=True)
+
+    # every orientation shown equally often, in random order
+    trial_angles = rng.permutation(np.resize(np.array(angles), num_trials))
+
+    for i, angle in enumerate(trial_angles):
+        write_tiff(os.path.join(tiff_dir, 'trial_%05d.tif' % (i + 1)),
+                   synthetic_trial(rng, angle, num_frames, lines, pixels))
+
+    metadata_dir = os.path.join(folder, 'vs.mat')
+    write_metadata(metadata_dir, trial_angles)
+
+    return tiff_dir, metadata_dir
+
+
+def measure(function, args, repeats):
+    """
+    Times a call and measures the memory it allocates
+
+    Returns: dict with the wall time of every repeat in seconds, the best and median time,
+    and the peak memory traced while it ran in bytes
+
+    Parameter function: the stage to measure
+    Precondition: function must be callable
+
+    Parameter args: arguments for the function
+    Precondition: args must be a tuple
+
+    Parameter repeats: number of timed calls
+    Precondition: repeats must be an int > 0
+    """
+    seconds = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function(*args)
+        seconds.append(time.perf_counter() - start)
+
+    # one more call under tracemalloc, kept out of the timings since tracing slows it down
+    tracemalloc.start()
+    function(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {'seconds': seconds, 'best_s': min(seconds), 'median_s': float(np.median(seconds)),
+            'peak_alloc_bytes': peak}
+
+
+def benchmark_session(tiff_dir, metadata_dir, repeats, selected=None):
+    """
+    Runs every stage on one session
+
+    Returns: dict of stage name -> measurement dict (see measure), with the reader and
+    compute stall times of the last prefetch pipeline the stage ran under 'prefetch'
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+
+    Parameter metadata_dir: filepath name for the metadata file
+    Precondition: metadata_dir must be a String
+
+    Parameter repeats: number of timed calls per stage
+    Precondition: repeats must be an int > 0
+
+    Parameter selected: names of the stages to run (defaults to all of them)
+    Precondition: selected must be None or a list of Strings from stages
+    """
+    # inputs of the stages that work on data already in memory
+    trials = tp.tif_processor_run(tiff_dir, metadata_dir)
+    lines = tp.average_line(trials)
+
+    calls = {'tif_processor_run': (tp.tif_processor_run, (tiff_dir, metadata_dir)),
+             'average_line': (tp.average_line, (trials,)),
+             'average_trials': (tp.average_trials, (lines, metadata_dir)),
+             'standard_deviation': (tp.standard_deviation, (tiff_dir, metadata_dir)),
+             'run_all': (tp.run_all, (tiff_dir, metadata_dir)),
+             'photon_count': (tp.photon_count, (tiff_dir, metadata_dir)),
+             'pca': (tp.pca, (tiff_dir, metadata_dir))}
+
+    results = {}
+    for name in stages:
+        if selected is None or name in selected:
+            function, args = calls[name]
+            pf.last_stats = None
+            results[name] = measure(function, args, repeats)
+            if pf.last_stats is not None:
+                results[name]['prefetch'] = pf.last_stats
+
+    return results
+
+
+def run(trial_counts, frame_sizes, repeats, folder, selected=None):
+    """
+    Generates a session for every trial count and frame size and benchmarks it. The array
+    cache is turned off so every call does the full work.
+
+    Returns: dict report with the environment and one result per session
+
+    Parameter trial_counts: numbers of trials to generate
+    Precondition: trial_counts must be a list of ints > 0
+
+    Parameter frame_sizes: frame sizes to generate
+    Precondition: frame_sizes must be a list of (lines, pixels) tuples
+
+    Parameter repeats: number of timed calls per stage
+    Precondition: repeats must be an int > 0
+
+    Parameter folder: folder to write the synthetic sessions to
+    Precondition: folder must be a String
+
+    Parameter selected: names of the stages to run (defaults to all of them)
+    Precondition: selected must be None or a list of Strings from stages
+    """
+    ac.enabled = False
+
+    report = {'pipeline_version': tp.pipeline_version,
+              'working_dtype': np.dtype(tp.working_dtype).name,
+              'python': platform.python_version(),
+              'numpy': np.__version__,
+              'platform': platform.platform(),
+              'cpu_count': os.cpu_count(),
+              'repeats': repeats,
+              'sessions': []}
+
+    for num_trials in trial_counts:
+        for lines, pixels in frame_sizes:
+            session = os.path.join(folder, '%d_trials_%dx%d' % (num_trials, lines, pixels))
+            tiff_dir, metadata_dir = generate_session(session, num_trials, frames, lines, pixels)
+
+            size = sum(os.path.getsize(os.path.join(tiff_dir, name))
+                       for name in os.listdir(tiff_dir))
+            results = benchmark_session(tiff_dir, metadata_dir, repeats, selected)
+
+            report['sessions'].append({'trials': num_trials, 'frames': frames, 'lines': lines,
+                                       'pixels': pixels, 'bytes_on_disk': size,
+                                       'stages': results})
+            print_session(report['sessions'][-1])
+
+    return report
+
+
+def print_session(session):
+    """
+    Prints the results of one session, one line per stage
+
+    Parameter session: the results of the session
+    Precondition: session must be a dict from the 'sessions' list of a report
+    """
+    print('%d trials, %d x %d' % (session['trials'], session['lines'], session['pixels']))
+    for name, result in session['stages'].items():
+        print('  %-20s %9.3f s %10.1f MB' % (name, result['best_s'],
+                                              result['peak_alloc_bytes'] / 1024 ** 2))
+        if 'prefetch' in result:
+            print('  %-20s %s' % ('', pf.summary(result['prefetch'])))
+
+
+def compare(old, new):
+    """
+    Prints the ratio of new to old best times for every stage of the sessions both reports
+    share; ratios above 1 are slowdowns
+
+    Parameter old: the baseline report
+    Precondition: old must be a dict returned by run
+
+    Parameter new: the report to compare
+    Precondition: new must be a dict returned by run
+    """
+    def key(session):
+        return session['trials'], session['frames'], session['lines'], session['pixels']
+
+    baseline = {key(session): session for session in old['sessions']}
+
+    for session in new['sessions']:
+        if key(session) not in baseline:
+            continue
+        print('%d trials, %d x %d (v%s -> v%s)' % (session['trials'], session['lines'],
+                                                  session['pixels'], old['pipeline_version'],
+                                                  new['pipeline_version']))
+        for name, result in session['stages'].items():
+            before = baseline[key(session)]['stages'].get(name)
+            if before is not None:
+                print('  %-20s x%.2f time  x%.2f memory'
+                      % (name, result['best_s'] / before['best_s'],
+                         result['peak_alloc_bytes'] / max(before['peak_alloc_bytes'], 1)))
+
+
+def main(argv=None):
+    """
+    Command line entry point
+    """
+    parser = argparse.ArgumentParser(description='Benchmark TiffProcessor on synthetic data.')
+    parser.add_argument('--trials', type=int, nargs='+', default=[8, 32],
+                        help='numbers of trials to generate')
+    parser.add_argument('--size', nargs='+', default=['64x64', '256x256'],
+                        help='frame sizes as LINESxPIXELS')
+    parser.add_argument('--stages', nargs='+', choices=stages, help='stages to run')
+    parser.add_argument('--repeats', type=int, default=3, help='timed calls per stage')
+    parser.add_argument('--data', help='folder to keep the synthetic sessions in '
+                                       '(default: a temporary folder, removed afterwards)')
+    parser.add_argument('--output', default='benchmark.json', help='json report to write')
+    parser.add_argument('--compare', help='earlier json report to compare against')
+    args = parser.parse_args(argv)
+
+    frame_sizes = [tuple(int(n) for n in size.split('x')) for size in args.size]
+    folder = args.data or tempfile.mkdtemp(prefix='snlab_benchmark_')
+
+    try:
+        report = run(args.trials, frame_sizes, args.repeats, folder, args.stages)
+    finally:
+        if args.data is None:
+            shutil.rmtree(folder, ignore_errors=True)
+
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,185 @@
+import os
+import json
+import struct
+import zipfile
+import numpy as np
+
+# constants
+# frames per second
+fps = 3.4
+
+# milliseconds per line
+mspl = 1.15
+
+# num of channels used
+num_channels = 4
+
+# extension of experiment store files
+extension = '.npz'
+
+# name of the member holding the acquisition constants
+constants_name = '__constants__'
+
+
+def store_path(name):
+    """
+    Returns: the pathname of the store file for an experiment
+
+    Parameter name: experiment name or pathname, with or without extension
+    Precondition: name must be a String
+    """
+    return name if name.endswith(extension) else name + extension
+
+
+def default_constants():
+    """
+    Returns: dict of the acquisition constants saved with every experiment
+    """
+    return {'fps': fps, 'mspl': mspl, 'num_channels': num_channels}
+
+
+def save(path, arrays, constants=None):
+    """
+    Writes named arrays and the acquisition constants to one uncompressed store file,
+    replacing any existing file
+
+    Parameter path: pathname of the store file
+    Precondition: path must be a String
+
+    Parameter arrays: the arrays to store by name
+    Precondition: arrays must be a dict of String -> numpy array
+
+    Parameter constants: acquisition constants (defaults to default_constants())
+    Precondition: constants must be None or a dict that can be written as json
+    """
+    path = store_path(path)
+
+    if constants is None:
+        constants = default_constants()
+
+    members = {name: np.asarray(array) for name, array in arrays.items()}
+    members[constants_name] = np.array(json.dumps(constants))
+
+    # write to a temporary file first so readers never see a partial store
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, **members)
+    os.replace(path + '.tmp', path)
+
+
+def add(path, arrays, constants=None):
+    """
+    Adds or replaces named arrays in a store file, keeping the arrays already in it
+
+    Parameter path: pathname of the store file
+    Precondition: path must be a String
+
+    Parameter arrays: the arrays to store by name
+    Precondition: arrays must be a dict of String -> numpy array
+
+    Parameter constants: acquisition constants (defaults to the ones already stored)
+    Precondition: constants must be None or a dict that can be written as json
+    """
+    path = store_path(path)
+
+    existing = {}
+    if os.path.exists(path):
+        for name in names(path):
+            if name not in arrays:
+                existing[name] = load(path, name, mmap=False)
+        if constants is None:
+            constants = read_constants(path)
+
+    existing.update(arrays)
+    save(path, existing, constants)
+
+
+def names(path):
+    """
+    Returns: list of the array names in a store file
+
+    Parameter path: pathname of the store file
+    Precondition: path must be a String
+    """
+    with zipfile.ZipFile(store_path(path)) as archive:
+        members = [os.path.splitext(member)[0] for member in archive.namelist()]
+
+    return [name for name in members if name != constants_name]
+
+
+def read_constants(path):
+    """
+    Returns: dict of the acquisition constants saved with an experiment
+
+    Parameter path: pathname of the store file
+    Precondition: path must be a String
+    """
+    with np.load(store_path(path)) as f:
+        return json.loads(str(f[constants_name]))
+
+
+def load(path, name, mmap=True):
+    """
+    Returns: one named array from a store file. With mmap the array is memory mapped
+    read-only, so slicing it only reads the requested part from disk.
+
+    Parameter path: pathname of the store file
+    Precondition: path must be a String
+
+    Parameter name: the name of the array
+    Precondition: name must be a String
+
+    Parameter mmap: map the array instead of reading it into memory
+    Precondition: mmap must be a boolean
+    """
+    path = store_path(path)
+
+    with zipfile.ZipFile(path) as archive:
+        info = archive.getinfo(name + '.npy')
+
+    if not mmap or info.compress_type != zipfile.ZIP_STORED:
+        with np.load(path) as f:
+            return f[name]
+
+    with open(path, 'rb') as f:
+        # skip the zip local file header to reach the .npy data of the member
+        f.seek(info.header_offset + 26)
+        name_length, extra_length = struct.unpack('<HH', f.read(4))
+        f.seek(info.header_offset + 30 + name_length + extra_length)
+
+        # read the .npy header to find the shape and where the data starts
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+
+    if dtype.hasobject or not shape:
+        with np.load(path) as f:
+            return f[name]
+
+    return np.memmap(path, dtype=dtype, mode='r', offset=offset, shape=shape,
+                     order='F' if fortran_order else 'C')
+
+
+def export_csv(path, name, csv_path=None):
+    """
+    Writes one named array of a store file to a csv file with one row per channel
+
+    Parameter path: pathname of the store file
+    Precondition: path must be a String
+
+    Parameter name: the name of the array
+    Precondition: name must be a String
+
+    Parameter csv_path: pathname of the csv file (defaults to the store name + '_' + name)
+    Precondition: csv_path must be None or a String
+    """
+    if csv_path is None:
+        csv_path = store_path(path)[:-len(extension)] + '_' + name + '.csv'
+
+    data = np.asarray(load(path, name))
+
+    # flatten everything after the channel axis for saving
+    np.savetxt(csv_path, data.reshape(np.size(data, axis=0), -1) if data.ndim > 1 else data,
+               delimiter=",")
@@ -0,0 +1,167 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import matplotlib
+import matplotlib.pyplot as plt
+import Grapher as g
+
+# number of worker processes that build and save figures
+num_workers = max(1, (os.cpu_count() or 1) - 1)
+
+# number of trials drawn on each chart
+trials_per_chart = 10
+
+# pool of export workers kept between exports, started by prewarm or the first export
+pool = None
+
+# number of workers in pool
+pool_workers = 0
+
+
+def use_agg():
+    """
+    Pool initializer: workers draw off screen with the Agg backend
+    """
+    matplotlib.use('Agg')
+
+
+def get_pool(workers):
+    """
+    Returns: the pool of export workers, started with the given number of workers if it is
+    not running yet (or was started with a different number)
+
+    Parameter workers: number of worker processes
+    Precondition: workers must be an int > 1
+    """
+    global pool, pool_workers
+
+    if pool is None or pool_workers != workers:
+        shutdown()
+
+        # spawned workers start clean instead of inheriting the GUI's window toolkit state
+        pool = ProcessPoolExecutor(max_workers=workers,
+                                   mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=use_agg)
+        pool_workers = workers
+
+    return pool
+
+
+def prewarm(workers=None):
+    """
+    Starts the export workers in the background so their imports of matplotlib and the
+    plotting modules are done before the first export
+
+    Parameter workers: number of worker processes (defaults to num_workers)
+    Precondition: workers must be None or an int >= 1
+    """
+    # a spawned worker that imports the caller's main script must not start a pool itself
+    if multiprocessing.parent_process() is not None:
+        return
+
+    if workers is None:
+        workers = num_workers
+
+    if workers > 1:
+        # one small job per worker makes the pool start all of them
+        warm = get_pool(workers)
+        for _ in range(workers):
+            warm.submit(use_agg)
+
+
+def shutdown():
+    """
+    Stops the export workers
+    """
+    global pool, pool_workers
+
+    if pool is not None:
+        pool.shutdown(cancel_futures=True)
+    pool = None
+    pool_workers = 0
+
+
+def trial_blocks(trial_data):
+    """
+    Returns: list of (block of trials, trial #s) tuples, one per chart (only full blocks of
+    trials_per_chart trials are charted)
+
+    Parameter trial_data: the line averaged data with trials in axis 0
+    Precondition: trial_data must be a numpy array with at least 3 dimensions
+    """
+    # flatten each channel for plotting as a line graph
+    trial_data = np.asarray(trial_data).reshape(np.size(trial_data, axis=0), g.num_channels, -1)
+
+    # determine how many charts to create for the dataset (only works for multiples of 10)
+    num_charts = np.size(trial_data, axis=0) // trials_per_chart
+
+    blocks = []
+    for i in range(num_charts):
+        # create trial index list for legend
+        trials = list(range((i * trials_per_chart) + 1, ((i + 1) * trials_per_chart) + 1))
+        blocks.append((trial_data[(i * trials_per_chart):((i + 1) * trials_per_chart)], trials))
+
+    return blocks
+
+
+def save_trial_chart(block, trials, title, filepath):
+    """
+    Builds and saves the per-channel charts for one block of trials, then closes them
+
+    Parameter block: the trials to chart
+    Precondition: block must be a 3D numpy array (trials, channels, time)
+
+    Parameter trials: the trial #s in the block
+    Precondition: trials must be a list of ints
+
+    Parameter title: the graph title the file names start with
+    Precondition: title must be a String
+
+    Parameter filepath: folder to save the charts to
+    Precondition: filepath must be a String
+    """
+    # worker processes do not see changes made to Grapher's settings in the GUI process
+    g.filepath = filepath
+
+    try:
+        g.plot_single_trial(block, trials, values={"-GRAPH_TITLE-": title}, show=False)
+    finally:
+        # free the figures so memory does not grow with the number of charts
+        plt.close('all')
+
+
+def export_trial_charts(trial_data, values, workers=None):
+    """
+    Saves one set of per-channel charts for every block of trials, building and saving the
+    figures on a pool of worker processes
+
+    Returns: the number of charts blocks saved
+
+    Parameter trial_data: the line averaged data with trials in axis 0
+    Precondition: trial_data must be a numpy array with at least 3 dimensions
+
+    Parameter values: a dict of information from the GUI event handler
+    Precondition: values must be a dict
+
+    Parameter workers: number of worker processes (defaults to num_workers)
+    Precondition: workers must be None or an int >= 1
+    """
+    if workers is None:
+        workers = num_workers
+
+    blocks = trial_blocks(trial_data)
+    title = values["-GRAPH_TITLE-"]
+
+    if workers > 1 and len(blocks) > 1:
+        # the workers stay up between exports, so only the first export waits for them
+        export_pool = get_pool(workers)
+        jobs = [export_pool.submit(save_trial_chart, block, trials, title, g.filepath)
+                for block, trials in blocks]
+        for job in jobs:
+            job.result()
+    else:
+        for block, trials in blocks:
+            save_trial_chart(block, trials, title, g.filepath)
+
+    return len(blocks)
@@ -0,0 +1,217 @@
+import os
+import time
+import numpy as np
+import TiffProcessor as tp
+import TiffReader as tr
+import RunningStats as rs
+import MetadataReader as mr
+import SessionManifest as sm
+
+# seconds between scans of the watched folder
+poll_interval = 1.0
+
+
+def create(tiff_dir, metadata_dir, dtype=None):
+    """
+    Returns: dict holding the state of a watched session: the files seen so far and running
+    statistics overall and for each orientation
+
+    Parameter tiff_dir: filepath name for folder the microscope writes tiff files to
+    Precondition: tiff_dir must be a String
+
+    Parameter metadata_dir: filepath name for the metadata file of the protocol
+    Precondition: metadata_dir must be a String
+
+    Parameter dtype: float dtype trials are processed in (defaults to tp.working_dtype)
+    Precondition: dtype must be None or a numpy float dtype
+    """
+    # the protocol lists every trial up front, so the orientation of each is known in advance
+    meta_data, num_orientations = mr.read_metadata(metadata_dir)
+    num_trials = np.size(meta_data)
+
+    return {'tiff_dir': tiff_dir,
+            'dtype': dtype or tp.working_dtype,
+            'num_trials': num_trials,
+            'groups': tp.trial_groups(metadata_dir, num_trials),
+            'angles': mr.read_angles(metadata_dir),
+            'seen': set(),
+            'sizes': {},
+            'overall': rs.create(),
+            'orientations': [rs.create() for _ in num_orientations],
+            'photons': [rs.create() for _ in num_orientations]}
+
+
+def is_complete(path):
+    """
+    Returns: True if a tif file holds whole frames for every channel
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+    """
+    try:
+        (frames, _, _), _ = tr.stack_shape(path)
+    except Exception:
+        # the writer has not finished the page directory yet
+        return False
+
+    # the 4 channels are interleaved frame by frame
+    return frames > 0 and frames % 4 == 0
+
+
+def new_files(state):
+    """
+    Returns: sorted list of pathnames of tif files that finished writing since the last scan.
+    A file counts as finished once its size is unchanged between two scans and it reads as a
+    complete stack; files already ingested are never looked at again.
+
+    Parameter state: the watched session
+    Precondition: state must be a dict returned by create
+    """
+    finished = []
+
+    for name in sorted(os.listdir(state['tiff_dir']), key=sm.natural_key):
+        if '.tif' not in name or name in state['seen']:
+            continue
+
+        path = state['tiff_dir'] + '/' + name
+        size = os.path.getsize(path)
+
+        # still growing (or first sighting): check again on the next scan
+        if state['sizes'].get(name) != size:
+            state['sizes'][name] = size
+            continue
+
+        if is_complete(path):
+            finished.append(name)
+
+    return finished
+
+
+def ingest(state, name):
+    """
+    Reads one new trial and folds it into the running statistics
+
+    Returns: dict describing the update: 'trial' (zero-based trial index), 'name', 'group'
+    (orientation index, -1 if the protocol does not list the trial), 'lines' (3D numpy array
+    of the trial's line averages), 'photons' (2D numpy array of its smoothed photon counts)
+    and 'average' (copy of the running average across all trials ingested so far)
+
+    Parameter state: the watched session
+    Precondition: state must be a dict returned by create
+
+    Parameter name: file name of the trial in the watched folder
+    Precondition: name must be a String
+    """
+    # trials are numbered by natural file name order, as list_tiffs and the protocol number
+    # them, so a trial that finishes after a later one still gets its own orientation
+    names = sorted((other for other in os.listdir(state['tiff_dir']) if '.tif' in other),
+                   key=sm.natural_key)
+    index = names.index(name)
+    state['seen'].add(name)
+    state['sizes'].pop(name, None)
+
+    # decode once for both the line averages and the photon counts
+    trial = tp.process_tiff(state['tiff_dir'] + '/' + name, state['dtype'])
+    lines = trial.mean(axis=-1, dtype=np.float64).astype(state['dtype'])
+    counts = tp.count_photons(trial)
+    photons = tp.moving_average(counts.reshape(np.size(counts, axis=0), -1), tp.photon_window)
+
+    group = state['groups'][index] if index < state['num_trials'] else -1
+
+    rs.update(state['overall'], lines)
+    if group >= 0:
+        rs.update(state['orientations'][group], lines)
+        rs.update(state['photons'][group], photons)
+
+    return {'trial': index, 'name': name, 'group': group, 'lines': lines, 'photons': photons,
+            'average': rs.mean(state['overall']).copy()}
+
+
+def poll(state, callback=None):
+    """
+    Ingests every trial that finished writing since the last scan
+
+    Returns: list of update dicts (see ingest), in trial order
+
+    Parameter state: the watched session
+    Precondition: state must be a dict returned by create
+
+    Parameter callback: called with each update dict as soon as its trial is ingested
+    Precondition: callback must be None or callable
+    """
+    updates = []
+
+    for name in new_files(state):
+        update = ingest(state, name)
+        updates.append(update)
+
+        if callback is not None:
+            callback(update)
+
+    return updates
+
+
+def results(state):
+    """
+    Returns: dict with the running results so far: 'trials' (number ingested), 'average'
+    (across all trials), 'averages', 'std', 'photon_counts' and 'photon_std' (one entry per
+    orientation, None for orientations with no trial yet)
+
+    Parameter state: the watched session
+    Precondition: state must be a dict returned by create
+    """
+    def summary(stats, statistic):
+        return statistic(stats) if stats['count'] > 0 else None
+
+    return {'trials': len(state['seen']),
+            'average': summary(state['overall'], rs.mean),
+            'averages': [summary(stats, rs.mean) for stats in state['orientations']],
+            'std': [summary(stats, rs.std) for stats in state['orientations']],
+            'photon_counts': [summary(stats, rs.mean) for stats in state['photons']],
+            'photon_std': [summary(stats, rs.std) for stats in state['photons']]}
+
+
+def watch(tiff_dir, metadata_dir, callback=None, stop=None, progress=None, dtype=None):
+    """
+    Watches a folder while the microscope writes to it, ingesting each trial once as soon as
+    it is complete, until every trial of the protocol has arrived or stop is set.
+    Progress is reported after every scan, so a job runner can show it and cancel the watch
+    by raising from the progress function.
+
+    Returns: dict with the final results (see results)
+
+    Parameter tiff_dir: filepath name for folder the microscope writes tiff files to
+    Precondition: tiff_dir must be a String
+
+    Parameter metadata_dir: filepath name for the metadata file of the protocol
+    Precondition: metadata_dir must be a String
+
+    Parameter callback: called with each update dict as soon as its trial is ingested
+    Precondition: callback must be None or callable
+
+    Parameter stop: event that ends the watch early when set
+    Precondition: stop must be None or a threading.Event
+
+    Parameter progress: called with (trials ingested, trials expected) after every scan
+    (defaults to tp.report_progress)
+    Precondition: progress must be None or callable
+
+    Parameter dtype: float dtype trials are processed in (defaults to tp.working_dtype)
+    Precondition: dtype must be None or a numpy float dtype
+    """
+    if progress is None:
+        progress = tp.report_progress
+
+    state = create(tiff_dir, metadata_dir, dtype)
+
+    while len(state['seen']) < state['num_trials']:
+        if stop is not None and stop.is_set():
+            break
+
+        poll(state, callback)
+        progress(len(state['seen']), state['num_trials'])
+
+        if len(state['seen']) < state['num_trials']:
+            time.sleep(poll_interval)
+
+    return results(state)
@@ -2,7 +2,8 @@ import numpy as np
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 import GrapherHelper as gh
-from SNLabGUI import GUIHelper as ghelper
+import ExperimentStore as es
+import Instrumentation as ins
 
 # constants
 pixelps = 3.4 / 65536.0
@@ -108,11 +109,13 @@ def label_plot(type, axes=None, channel_num=None, files_names=None, trial_indice
         plt.suptitle(values["-GRAPH_TITLE-"] + '_std_by_channel')
 
 
+@ins.timed('plot by channel')
 def plot_by_channel():
     """
     Plots the selected data sets by grouping corresponding channels on same figure
     """
-    # import gui file for use
+    # import gui file for use (here, so plotting works without PySimpleGUI installed)
+    from SNLabGUI import GUIHelper as ghelper
 
     # select data sets
     data_sets = ghelper.choose_datasets()
@@ -130,7 +133,11 @@ def plot_by_channel():
     for pathName in data_sets:
         # slice file name out of pathname and append to filename list
         file_names.append(gh.get_filename_without_extension(pathName))
-        data = np.genfromtxt(pathName, delimiter=',')
+        # experiment stores are read directly, anything else is parsed as csv
+        if pathName.endswith(es.extension):
+            data = es.load(pathName, 'averages')
+        else:
+            data = np.genfromtxt(pathName, delimiter=',')
         data_list.append(data)
 
     # iterate through each dataset for each channel (4x4 iterations)
@@ -140,8 +147,8 @@ def plot_by_channel():
 
         for i, data in enumerate(data_list):
             # plot data
-            plt.scatter(time_series, data[channel], label=channel, s=0.1,
-                        color=channel_color[i])
+            gh.plot_line(plt.gca(), time_series, data[channel], label=channel, linewidth=0.3,
+                         color=channel_color[i])
 
         # create legend
         label_plot(type=3, channel_num=channel, files_names=file_names)
@@ -149,6 +156,21 @@ def plot_by_channel():
     plt.show(block=False)
 
 
+@ins.timed('plot frame histogram')
+def plot_frame_histogram(frame):
+    """
+    Plots a histogram of the values of each line of a frame
+
+    Parameter frame: normalized values of one frame of one channel
+    Precondition: frame must be a 2D numpy array (lines, pixels)
+    """
+    plt.figure()
+    plt.hist(frame)
+
+    plt.show(block=False)
+
+
+@ins.timed('plot data')
 def plot_data(selected_sets, type, values=None):
     """
     Plots the selected data sets
@@ -190,8 +212,8 @@ def plot_data(selected_sets, type, values=None):
                 axe.set_title(label)
                 # plot each channel on subplot
                 for c in range(num_channels):
-                    axe.scatter(time_series, selected_sets[i * 2 + j][c], label=c, s=0.1,
-                                color=channel_color[c])
+                    gh.plot_line(axe, time_series, selected_sets[i * 2 + j][c], label=c,
+                                 linewidth=0.3, color=channel_color[c])
                 # increment label counter
                 counter += 30
 
@@ -204,8 +226,8 @@ def plot_data(selected_sets, type, values=None):
     elif type == 2:
         # plot each channel on subplot
         for c in range(num_channels):
-            plt.scatter(time_series, selected_sets[c], label=c, s=0.1,
-                        color=channel_color[c])
+            gh.plot_line(plt.gca(), time_series, selected_sets[c], label=c, linewidth=0.3,
+                         color=channel_color[c])
 
         # label plots
         label_plot(type, values=values)
@@ -225,7 +247,8 @@ def plot_data(selected_sets, type, values=None):
         plt.show(block=False)
 
 
-def plot_single_trial(selected_sets, trials, values):
+@ins.timed('plot trials')
+def plot_single_trial(selected_sets, trials, values, show=True):
     """
     Function that plots single selected trials on same chart
 
@@ -237,6 +260,9 @@ def plot_single_trial(selected_sets, trials, values):
 
     Parameter trials: a list of trial #s that were plotted
     Precondition: trials must be a list of ints
+
+    Parameter show: whether to show the figures after saving them
+    Precondition: show must be a boolean
     """
 
     # assign analysis type
@@ -259,11 +285,10 @@ def plot_single_trial(selected_sets, trials, values):
         # plot each trial on graph by iterating through dataset and list of colors to graph with
         for trial, color in zip(selected_sets, mcolors.TABLEAU_COLORS):
             # reshape array to plot as line graph
-            print(trial.shape)
             #trial = trial.reshape(4, 5376)
 
-            plt.plot(time_series, trial[c], label=c,
-                     color=color)
+            gh.plot_line(plt.gca(), time_series, trial[c], label=c,
+                         color=color)
 
         # label plots
         label_plot(type, trial_indices=trials, channel_num=c, values=values)
@@ -281,9 +306,11 @@ def plot_single_trial(selected_sets, trials, values):
         # save file
         gh.save_file(filepath=filepath, filename=file_name, figure=figure, subdir=subdir)
 
-    plt.show(block=False)
+    if show:
+        plt.show(block=False)
 
 
+@ins.timed('plot std')
 def plot_std(average_data, std_data, values):
     """
     Function that plots average of trials with standard deviation bars
@@ -328,21 +355,23 @@ def plot_std(average_data, std_data, values):
             label = "Channel " + str(c + 1)
             axe.set_title(label)
             # plot each channel on subplot
-            axe.errorbar(time_series, average_data[c], yerr=std_data[c],
-                         color=channel_color[c], ecolor="black", elinewidth=0.1, linewidth=0.3)
+            gh.plot_line(axe, time_series, average_data[c], color=channel_color[c],
+                         linewidth=0.3)
+            gh.plot_std_band(axe, time_series, average_data[c], std_data[c])
             c = c + 1
 
-            label_plot(type=5, axes=axes, values=values)
-            fig.tight_layout(pad=5.0)
+    # label plots and lay them out once all four are drawn
+    label_plot(type=5, axes=axes, values=values)
+    fig.tight_layout(pad=5.0)
 
     # determine filename
-    file_name = 'std/' + values["-GRAPH_TITLE-"] + '_std_by_channel' + '_FIGURE.pdf'
+    file_name = values["-GRAPH_TITLE-"] + '_std_by_channel' + '_FIGURE.pdf'
 
     # assign most recent figure to 'figure'
     figure = plt.gcf()
 
     # save file
-    gh.save_file(filepath=filepath, filename=file_name, figure=figure)
+    gh.save_file(filepath=filepath, filename=file_name, figure=figure, subdir='std/')
 
     # show figure
     plt.show(block=False)
@@ -350,10 +379,12 @@ def plot_std(average_data, std_data, values):
     # create new figure
     plt.figure(figsize=(30, 19.5))
 
-    # plot each channel on subplot
+    # plot each channel on subplot, lines first so the legend labels them
+    for c in range(num_channels):
+        gh.plot_line(plt.gca(), time_series, average_data[c], color=channel_color[c],
+                     linewidth=0.3)
     for c in range(num_channels):
-        plt.errorbar(time_series, average_data[c], yerr=std_data[c],
-                     color=channel_color[c], ecolor="black", elinewidth=0.1, linewidth=0.3)
+        gh.plot_std_band(plt.gca(), time_series, average_data[c], std_data[c])
 
     # determine filename
     file_name = values["-GRAPH_TITLE-"] + '_std' + '_FIGURE.pdf'
@@ -1,9 +1,15 @@
 import os
 import numpy as np
+import Instrumentation as ins
 
 # milliseconds per line
 mspl = 1.15
 
+# rasterize lines and std bands into one image per subplot in saved PDFs. Smaller work for
+# PDF viewers, but saving is several times slower than writing the decimated vector paths,
+# so it is off by default
+rasterize_dense = False
+
 
 def get_filename_without_extension(path):
     """
@@ -37,6 +43,7 @@ def initialize_time_series(data_sets, type=None):
     return np.array(time_series)
 
 
+@ins.timed('save figure')
 def save_file(filepath, filename, figure, subdir):
     """
     Saves figure to filepath + filename
@@ -48,8 +55,147 @@ def save_file(filepath, filename, figure, subdir):
     Precondition: filename must be a String
     """
     # make folder
-    if not os.path.exists(filepath + subdir):
-        os.makedirs(filepath + subdir)
+    os.makedirs(filepath + subdir, exist_ok=True)
+
+    # write to a temporary file first so a half-written pdf never replaces a good one
+    path = filepath + subdir + filename
+    figure.savefig(path + '.tmp', format='pdf', dpi=100)
+    os.replace(path + '.tmp', path)
+
+
+def pixel_width(axes):
+    """
+    Returns the width of a subplot in pixels at the figure's dpi
+
+    Parameter axes: the subplot to measure
+    Precondition: axes must be a Matplotlib Axes
+    """
+    return max(int(axes.bbox.width), 1)
+
+
+def bucket_indices(num_points, num_buckets):
+    """
+    Returns a list of index arrays, one per bucket, splitting num_points into equal buckets
+
+    Parameter num_points: the number of points in the series
+    Precondition: num_points must be an int
+
+    Parameter num_buckets: the number of buckets to split the series into
+    Precondition: num_buckets must be an int
+    """
+    size = int(np.ceil(num_points / num_buckets))
+    full = num_points // size
+
+    # full buckets as rows of a matrix, plus the leftover points as a last bucket
+    rows = np.arange(full * size).reshape(full, size)
+    if full * size < num_points:
+        return rows, np.arange(full * size, num_points)
+
+    return rows, None
+
+
+@ins.timed('decimate')
+def decimate(x, y, width):
+    """
+    Returns x, y reduced to the minimum and maximum point of each of width buckets, in time
+    order, so a line drawn through them covers the same pixels as the full series
+
+    Parameter x: the time series
+    Precondition: x must be a 1D numpy array
+
+    Parameter y: the values to plot
+    Precondition: y must be a 1D numpy array with the same size as x
+
+    Parameter width: the number of pixels the series is drawn across
+    Precondition: width must be an int
+    """
+    x, y = np.asarray(x), np.ravel(y)
+
+    # nothing to gain when there are fewer than two points per pixel
+    if y.size <= 2 * width:
+        return x, y
+
+    rows, rest = bucket_indices(y.size, width)
+
+    # position of the lowest and highest point in every bucket
+    keep = [rows[np.arange(len(rows)), y[rows].argmin(axis=1)],
+            rows[np.arange(len(rows)), y[rows].argmax(axis=1)]]
+    if rest is not None:
+        keep += [rest[[y[rest].argmin(), y[rest].argmax()]]]
+
+    keep = np.unique(np.concatenate(keep))
+
+    return x[keep], y[keep]
+
+
+def rasterize_data(axes):
+    """
+    If rasterize_dense is set, makes a subplot rasterize its lines and bands into a single
+    image when saved as a vector file, while axes, ticks, labels and legends stay vector
+
+    Parameter axes: the subplot
+    Precondition: axes must be a Matplotlib Axes
+    """
+    # lines (zorder 2) and bands (zorder 1) sit below this, axis decorations above it
+    if rasterize_dense:
+        axes.set_rasterization_zorder(2.5)
+
+
+def plot_line(axes, x, y, **kwargs):
+    """
+    Draws a dense series as a line decimated to the subplot's pixel width
+
+    Parameter axes: the subplot to draw on
+    Precondition: axes must be a Matplotlib Axes
+
+    Parameter x: the time series
+    Precondition: x must be a 1D numpy array
+
+    Parameter y: the values to plot
+    Precondition: y must be a numpy array with the same number of values as x
+    """
+    x, y = decimate(x, y, pixel_width(axes))
+
+    rasterize_data(axes)
+
+    return axes.plot(x, y, **kwargs)
+
+
+def plot_std_band(axes, x, mean, std):
+    """
+    Draws a +/- one standard deviation band around a dense series instead of error bars.
+    The band sits below lines and is drawn after them, so legends still list the lines first.
+
+    Parameter axes: the subplot to draw on
+    Precondition: axes must be a Matplotlib Axes
+
+    Parameter x: the time series
+    Precondition: x must be a 1D numpy array
+
+    Parameter mean: the values to plot
+    Precondition: mean must be a numpy array with the same number of values as x
+
+    Parameter std: the standard deviation of each value
+    Precondition: std must be a numpy array with the same number of values as x
+    """
+    x, mean, std = np.asarray(x), np.ravel(mean), np.ravel(std)
+    lower, upper = mean - std, mean + std
+
+    width = pixel_width(axes)
+    if mean.size > 2 * width:
+        # envelope of the band within each pixel bucket
+        rows, rest = bucket_indices(mean.size, width)
+        band_x = x[rows].mean(axis=1)
+        band_lower = lower[rows].min(axis=1)
+        band_upper = upper[rows].max(axis=1)
+        if rest is not None:
+            band_x = np.append(band_x, x[rest].mean())
+            band_lower = np.append(band_lower, lower[rest].min())
+            band_upper = np.append(band_upper, upper[rest].max())
+    else:
+        band_x, band_lower, band_upper = x, lower, upper
+
+    rasterize_data(axes)
 
-    figure.savefig(filepath + subdir + filename,
-                   format='pdf', dpi=100)
+    return axes.fill_between(band_x, band_lower, band_upper, color="black", alpha=0.3,
+                             linewidth=0, zorder=1)
@@ -0,0 +1,272 @@
+import os
+import json
+import time
+import threading
+import functools
+import tracemalloc
+from contextlib import contextmanager
+
+# record stages only while enabled; when off, stage() does nothing
+enabled = False
+
+# recorded stages: dicts with name, file, thread, depth (number of stages it ran inside),
+# start, seconds, bytes_read, peak_bytes and retained_bytes, in the order they finished
+events = []
+
+# per-thread stack of the stages that are running, innermost last
+running = threading.local()
+
+# perf_counter value events are measured from
+origin = time.perf_counter()
+
+# whether start() turned tracemalloc on and so should turn it off again
+started_tracing = False
+
+
+def start(trace_memory=True):
+    """
+    Clears earlier records and starts recording stages
+
+    Parameter trace_memory: also measure allocations with tracemalloc (slower)
+    Precondition: trace_memory must be a boolean
+    """
+    global enabled, origin, started_tracing
+
+    reset()
+    origin = time.perf_counter()
+
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+        started_tracing = True
+
+    enabled = True
+
+
+def stop():
+    """
+    Stops recording stages; the records stay available until the next start or reset
+    """
+    global enabled, started_tracing
+
+    enabled = False
+
+    if started_tracing:
+        tracemalloc.stop()
+        started_tracing = False
+
+
+def reset():
+    """
+    Removes every recorded stage
+    """
+    del events[:]
+
+
+def stack():
+    """
+    Returns: list of the stages running on this thread, innermost last
+    """
+    if not hasattr(running, 'stages'):
+        running.stages = []
+
+    return running.stages
+
+
+@contextmanager
+def stage(name, path=None):
+    """
+    Records the wall time, bytes read and memory allocated by the code it wraps. Peaks of
+    nested stages count towards the stages around them. Memory is traced for the whole
+    process, so stages running on other threads at the same time add to each other's peaks.
+
+    Parameter name: the name of the stage
+    Precondition: name must be a String
+
+    Parameter path: the file the stage works on, if any
+    Precondition: path must be None or a String
+    """
+    if not enabled:
+        yield
+        return
+
+    stages = stack()
+    tracing = tracemalloc.is_tracing()
+
+    record = {'name': name, 'file': None if path is None else os.path.basename(path),
+              'thread': threading.get_ident(), 'depth': len(stages), 'bytes_read': 0,
+              'peak_bytes': None, 'retained_bytes': None, 'inner_peak': 0}
+
+    if tracing:
+        # fold the peak so far into the enclosing stage before restarting the peak here
+        current, peak = tracemalloc.get_traced_memory()
+        if stages:
+            stages[-1]['inner_peak'] = max(stages[-1]['inner_peak'], peak)
+        tracemalloc.reset_peak()
+        record['start_bytes'] = current
+
+    stages.append(record)
+    start_time = time.perf_counter()
+
+    try:
+        yield
+    finally:
+        record['seconds'] = time.perf_counter() - start_time
+        record['start'] = start_time - origin
+        stages.pop()
+
+        if tracing and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            peak = max(peak, record['inner_peak'])
+            record['peak_bytes'] = peak - record['start_bytes']
+            record['retained_bytes'] = current - record['start_bytes']
+
+            # the enclosing stage saw this peak too
+            if stages:
+                stages[-1]['inner_peak'] = max(stages[-1]['inner_peak'], peak)
+
+        # the enclosing stage read everything this one read
+        if stages:
+            stages[-1]['bytes_read'] += record['bytes_read']
+
+        del record['inner_peak']
+        record.pop('start_bytes', None)
+        events.append(record)
+
+
+def timed(name):
+    """
+    Returns: decorator that records every call of a function as a stage
+
+    Parameter name: the name of the stage
+    Precondition: name must be a String
+    """
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return function(*args, **kwargs)
+        return wrapper
+
+    return decorate
+
+
+def add_bytes_read(num_bytes):
+    """
+    Adds bytes read from disk to the innermost running stage on this thread
+
+    Parameter num_bytes: the number of bytes read
+    Precondition: num_bytes must be an int
+    """
+    if enabled and stack():
+        stack()[-1]['bytes_read'] += int(num_bytes)
+
+
+def totals(records=None):
+    """
+    Returns: dict of stage name -> dict with the number of calls, total seconds, total bytes
+    read and largest peak allocation, in the order stages first finished
+
+    Parameter records: the recorded stages to total (defaults to events)
+    Precondition: records must be None or a list of records like events
+    """
+    if records is None:
+        records = events
+
+    summary = {}
+
+    for record in records:
+        total = summary.setdefault(record['name'], {'calls': 0, 'seconds': 0.0, 'bytes_read': 0,
+                                                    'peak_bytes': None})
+        total['calls'] += 1
+        total['seconds'] += record['seconds']
+        total['bytes_read'] += record['bytes_read']
+        if record['peak_bytes'] is not None:
+            total['peak_bytes'] = max(total['peak_bytes'] or 0, record['peak_bytes'])
+
+    return summary
+
+
+def report(records=None):
+    """
+    Returns: dict with the totals per stage and every recorded stage, per file
+
+    Parameter records: the recorded stages to report (defaults to events)
+    Precondition: records must be None or a list of records like events
+    """
+    if records is None:
+        records = events
+
+    return {'stages': totals(records), 'events': list(records)}
+
+
+def write_report(path, records=None):
+    """
+    Writes the report as json
+
+    Parameter path: pathname of the json file
+    Precondition: path must be a String
+
+    Parameter records: the recorded stages to report (defaults to events)
+    Precondition: records must be None or a list of records like events
+    """
+    with open(path, 'w') as f:
+        json.dump(report(records), f, indent=2)
+
+
+def write_chrome_trace(path, records=None):
+    """
+    Writes every recorded stage as a Chrome trace (open in chrome://tracing or Perfetto)
+
+    Parameter path: pathname of the trace file
+    Precondition: path must be a String
+
+    Parameter records: the recorded stages to write (defaults to events)
+    Precondition: records must be None or a list of records like events
+    """
+    if records is None:
+        records = events
+
+    trace = []
+    for record in records:
+        trace.append({'name': record['name'], 'ph': 'X', 'pid': os.getpid(),
+                      'tid': record['thread'], 'ts': record['start'] * 1e6,
+                      'dur': record['seconds'] * 1e6,
+                      'args': {key: record[key] for key in ('file', 'bytes_read', 'peak_bytes',
+                                                            'retained_bytes')}})
+
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+
+
+def summary(top=4, records=None):
+    """
+    Returns: one line naming the slowest stages with their share of the total time, the data
+    read and the largest peak allocation
+
+    Parameter top: number of stages to name
+    Precondition: top must be an int > 0
+
+    Parameter records: the recorded stages to summarize (defaults to events)
+    Precondition: records must be None or a list of records like events
+    """
+    if records is None:
+        records = events
+
+    # only the outermost stages add up to the wall time
+    outer = sum(record['seconds'] for record in records if record['depth'] == 0)
+    if outer == 0:
+        return 'no stages recorded'
+
+    stages = sorted(totals(records).items(), key=lambda item: item[1]['seconds'], reverse=True)
+    parts = ['%s %.2f s (%.0f%%)' % (name, total['seconds'], 100 * total['seconds'] / outer)
+             for name, total in stages[:top]]
+
+    read = sum(record['bytes_read'] for record in records if record['depth'] == 0)
+    peaks = [total['peak_bytes'] for _, total in stages if total['peak_bytes'] is not None]
+
+    line = ', '.join(parts) + '; read %.0f MB' % (read / 1024 ** 2)
+    if peaks:
+        line += ', peak %.0f MB' % (max(peaks) / 1024 ** 2)
+
+    return line
+
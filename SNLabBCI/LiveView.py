@@ -0,0 +1,178 @@
+import time
+from collections import deque
+import numpy as np
+import matplotlib.pyplot as plt
+import GrapherHelper as gh
+
+# num of channels used
+num_channels = 4
+
+# dict with channel numbers and corresponding colors
+channel_color = {0: 'Green', 1: 'Blue', 2: 'Gold', 3: 'Red'}
+
+# redraws per second at most; updates arriving faster are shown at the next redraw
+target_fps = 10
+
+# number of latest trials overlaid behind the running average
+overlay_trials = 5
+
+
+def create(title='Live View'):
+    """
+    Opens a figure with one subplot per channel whose lines are updated in place
+
+    Returns: dict holding the figure, its persistent line artists and the data to draw
+
+    Parameter title: the window title
+    Precondition: title must be a String
+    """
+    figure, axes = plt.subplots(num_channels, 1, sharex=True, figsize=(12, 9), num=title)
+
+    view = {'figure': figure,
+            'axes': axes,
+            'recent': deque(maxlen=overlay_trials),
+            'average': None,
+            'x': None,
+            'background': None,
+            'last_draw': 0.0,
+            'pending': False}
+
+    # persistent artists: the latest trials fading out behind the running average. Animated
+    # artists are left out of normal draws and only painted by blitting
+    view['trial_lines'] = [[ax.plot([], [], color='gray', linewidth=0.5, animated=True)[0]
+                            for _ in range(overlay_trials)] for ax in axes]
+    view['average_lines'] = [ax.plot([], [], color=channel_color[c], linewidth=1.0,
+                                     animated=True)[0]
+                             for c, ax in enumerate(axes)]
+
+    for c, ax in enumerate(axes):
+        # normalized data stays within [0, 1], so the limits never need to change
+        ax.set_ylim(0, 1)
+        ax.set_ylabel('Channel ' + str(c + 1))
+    axes[-1].set_xlabel('Time (ms)')
+
+    # capture a fresh background whenever the figure is fully redrawn (e.g. resized)
+    figure.canvas.mpl_connect('draw_event', lambda event: capture_background(view))
+
+    plt.show(block=False)
+    figure.canvas.draw()
+
+    return view
+
+
+def capture_background(view):
+    """
+    Saves the figure without its animated lines and paints the lines back over it
+
+    Parameter view: the live view
+    Precondition: view must be a dict returned by create
+    """
+    canvas = view['figure'].canvas
+    view['background'] = canvas.copy_from_bbox(view['figure'].bbox)
+    draw_lines(view)
+
+
+def is_open(view):
+    """
+    Returns: True while the live view's window has not been closed
+
+    Parameter view: the live view
+    Precondition: view must be a dict returned by create
+    """
+    return plt.fignum_exists(view['figure'].number)
+
+
+def update(view, average, trial=None):
+    """
+    Sets the data to show and redraws if the last redraw was long enough ago
+
+    Returns: True if the view was redrawn, False if the redraw was deferred
+
+    Parameter view: the live view
+    Precondition: view must be a dict returned by create
+
+    Parameter average: the running average to draw
+    Precondition: average must be a numpy array with one row of values per channel (any
+    further axes are flattened in time order)
+
+    Parameter trial: the latest trial to add to the overlay
+    Precondition: trial must be None or a numpy array shaped like average
+    """
+    view['average'] = np.reshape(average, (num_channels, -1))
+    if trial is not None:
+        view['recent'].append(np.reshape(trial, (num_channels, -1)))
+
+    # the time axis only needs building when the number of points changes
+    num_points = np.size(view['average'], axis=1)
+    if view['x'] is None or np.size(view['x']) != num_points:
+        view['x'] = np.arange(num_points) * gh.mspl
+        for ax in view['axes']:
+            ax.set_xlim(0, view['x'][-1])
+        view['figure'].canvas.draw()
+
+    view['pending'] = True
+
+    return flush(view)
+
+
+def flush(view, force=False):
+    """
+    Redraws pending data unless that would exceed target_fps
+
+    Returns: True if the view was redrawn
+
+    Parameter view: the live view
+    Precondition: view must be a dict returned by create
+
+    Parameter force: redraw regardless of the frame rate
+    Precondition: force must be a boolean
+    """
+    if not view['pending'] or not is_open(view):
+        return False
+
+    now = time.perf_counter()
+    if not force and now - view['last_draw'] < 1.0 / target_fps:
+        return False
+
+    canvas = view['figure'].canvas
+
+    # start from the saved background instead of redrawing axes, ticks and labels
+    canvas.restore_region(view['background'])
+    draw_lines(view)
+    canvas.blit(view['figure'].bbox)
+    canvas.flush_events()
+
+    view['last_draw'] = now
+    view['pending'] = False
+
+    return True
+
+
+def draw_lines(view):
+    """
+    Moves the new data into the persistent line artists and paints them
+
+    Parameter view: the live view
+    Precondition: view must be a dict returned by create
+    """
+    if view['average'] is None:
+        return
+
+    recent = list(view['recent'])
+
+    for c, ax in enumerate(view['axes']):
+        width = gh.pixel_width(ax)
+
+        # oldest trials are the faintest
+        for i, line in enumerate(view['trial_lines'][c]):
+            if i < len(recent):
+                line.set_data(*gh.decimate(view['x'], recent[i][c], width))
+                line.set_alpha(0.15 + 0.5 * (i + 1) / len(recent))
+                line.set_visible(True)
+            else:
+                line.set_visible(False)
+            ax.draw_artist(line)
+
+        line = view['average_lines'][c]
+        line.set_data(*gh.decimate(view['x'], view['average'][c], width))
+        ax.draw_artist(line)
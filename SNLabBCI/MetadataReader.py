@@ -1,57 +1,75 @@
 import os
 import numpy as np
-from PIL import Image
-import scipy.io
-import math
+import Instrumentation as ins
 
+# parsed metadata by (pathname, size, modification time) so each .mat file is read once
+metadata_cache = {}
 
-def read_metadata(metadata_dir):
+
+def parse_metadata(metadata_dir):
     """
-    Reads and processes the metadata for the experiment from the metadata MAT file
+    Reads the trial order and orientations from the metadata MAT file, once per file version
+
+    Returns: dict with 'order' (1D numpy array of zero-based trial indices grouped by
+    angle), 'angles' (1D numpy array of the distinct angles, ascending) and 'counts' (1D
+    numpy array with the number of trials for each angle)
 
     Parameter metadata_dir: the pathname for the metadata file
     Precondition: metadata_dir must a String
     """
-    # constant list with orientations
-    # all orientations
-    # orientations = [0, 30, 60, 90, 120, 150, 180, 210, 240, 270, 300, 330]
+    stat = os.stat(metadata_dir)
+    key = (os.path.abspath(metadata_dir), stat.st_size, stat.st_mtime_ns)
+
+    if key not in metadata_cache:
+        with ins.stage('metadata', metadata_dir):
+            # imported on first use, it is slow to import and only needed here
+            import scipy.io
 
-    # two orientations
-    orientations = [90, 180]
+            # read in metadata file
+            f = scipy.io.loadmat(metadata_dir)
+            ins.add_bytes_read(stat.st_size)
 
-    # set numpy array to print non-truncated version
-    np.set_printoptions(threshold=np.inf)
+            # save useful data to numpy array
+            data = np.array(f['vs'][0][0][2])
 
-    # read in metadata file
-    f = scipy.io.loadmat(metadata_dir)
+            # save order of orientations: column 0 is the file #, column 1 the angle
+            data = data[:, ::16]
 
-    # save useful data to numpy array
-    data = np.array(f['vs'][0][0][2])
+            # every angle found in the protocol and the number of trials shown at each
+            angles, counts = np.unique(data[:, 1], return_counts=True)
 
-    # save order of orientations
-    data = data[:, ::16]
+            # reorder trials to group by angle, keeping acquisition order within an angle
+            order = np.argsort(data[:, 1], kind='stable')
 
-    # generate list with number of trials for each orientation
-    num_orientations = []
+            # file # to zero-based trial index
+            order = (data[order, 0] - 1).astype(int, casting='unsafe')
 
-    for angleConstant in orientations:
-        count = 0
-        for angleTrial in data:
-            if angleTrial[1] == angleConstant:
-                count = count + 1
-        num_orientations.append(count)
+            metadata_cache[key] = {'order': order, 'angles': angles, 'counts': counts}
+
+    return metadata_cache[key]
+
+
+def read_metadata(metadata_dir):
+    """
+    Reads and processes the metadata for the experiment from the metadata MAT file
 
-    sum_orientations = np.array(num_orientations).cumsum()
-    # reorder array to group by angle
-    sorted_list = np.array(sorted(data, key=lambda x: x[1]))
+    Returns: tuple of 1D numpy array with the trial indices grouped by angle and list with
+    the number of trials for each angle
 
-    # return 2D numpy array with each element having a list with two elements: file # and
-    # orientation
-    sorted_list = sorted_list[:, 0] - 1
+    Parameter metadata_dir: the pathname for the metadata file
+    Precondition: metadata_dir must a String
+    """
+    metadata = parse_metadata(metadata_dir)
 
-    # cast index list values to ints
-    result = np.array(sorted_list).astype(int, casting='unsafe')
+    return metadata['order'], metadata['counts'].tolist()
 
-    return result, num_orientations
 
+def read_angles(metadata_dir):
+    """
+    Returns: 1D numpy array with the distinct angles of the experiment, in the same order
+    as the groups returned by read_metadata
 
+    Parameter metadata_dir: the pathname for the metadata file
+    Precondition: metadata_dir must a String
+    """
+    return parse_metadata(metadata_dir)['angles']
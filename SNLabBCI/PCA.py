@@ -0,0 +1,227 @@
+import numpy as np
+
+# trials folded in at a time; each batch holds (trials, channels, samples) in memory
+batch_trials = 8
+
+# extra directions kept beyond the requested components while fitting (random directions of
+# the randomized method, retained components of the incremental one), for accuracy
+oversamples = 10
+
+# power iterations of the randomized method; each one costs two more passes over the data
+power_iterations = 1
+
+
+def sign_flip(components, scores=None):
+    """
+    Flips the sign of every component so its largest loading is positive, so results are
+    the same whatever method or batch order found them
+
+    Returns: tuple of the flipped components and scores
+
+    Parameter components: the components of one channel
+    Precondition: components must be a 2D numpy array (components, samples)
+
+    Parameter scores: the trial scores of the same channel
+    Precondition: scores must be None or a 2D numpy array (trials, components)
+    """
+    largest = np.argmax(np.abs(components), axis=1)
+    signs = np.sign(components[np.arange(np.size(components, axis=0)), largest])
+    signs[signs == 0] = 1
+
+    return components * signs[:, None], None if scores is None else scores * signs
+
+
+def incremental_update(state, x):
+    """
+    Folds one batch of trials of one channel into an incremental PCA (the sequential
+    Karhunen-Loeve update used by incremental PCA): the retained components, weighted by
+    their singular values, are stacked with the centered batch and a mean correction row
+    and decomposed again
+
+    Parameter state: the running decomposition of the channel, updated in place
+    Precondition: state must be a dict with 'count', 'mean', 'components',
+    'singular_values' and 'k'
+
+    Parameter x: the batch
+    Precondition: x must be a 2D numpy array (trials, samples)
+    """
+    count = np.size(x, axis=0)
+    batch_mean = np.mean(x, axis=0)
+
+    if state['count'] == 0:
+        stacked = x - batch_mean
+        mean = batch_mean
+    else:
+        total = state['count'] + count
+        correction = np.sqrt(state['count'] * count / total) * (state['mean'] - batch_mean)
+        stacked = np.vstack((state['singular_values'][:, None] * state['components'],
+                             x - batch_mean, correction))
+        mean = state['mean'] + (batch_mean - state['mean']) * count / total
+
+    _, singular_values, vt = np.linalg.svd(stacked, full_matrices=False)
+
+    state['count'] += count
+    state['mean'] = mean
+    state['components'] = vt[:state['k']]
+    state['singular_values'] = singular_values[:state['k']]
+
+
+def orthonormal(y):
+    """
+    Returns: orthonormal basis of the columns of y, channel by channel
+
+    Parameter y: the matrices to orthonormalize
+    Precondition: y must be a 3D numpy array (channels, rows, columns)
+    """
+    return np.linalg.qr(y)[0]
+
+
+def fit_incremental(batches, components):
+    """
+    Incremental PCA: one pass to fit the components and one to score every trial. Keeps
+    oversamples more components than requested while fitting so truncating each update loses
+    less of the smaller components.
+
+    Returns: tuple of (mean, components, singular values, scores, sum of squares) per channel
+
+    Parameter batches: returns a new iterator of (trials, channels, samples) batches on
+    every call
+    Precondition: batches must be callable
+
+    Parameter components: the number of components to keep
+    Precondition: components must be an int > 0
+    """
+    states = None
+    for x in batches():
+        if states is None:
+            states = [{'count': 0, 'mean': None, 'components': None, 'singular_values': None,
+                       'k': components + oversamples} for _ in range(np.size(x, axis=1))]
+            sum_squares = np.zeros(np.size(x, axis=1))
+        sum_squares += np.einsum('bcd,bcd->c', x, x)
+        for c, state in enumerate(states):
+            incremental_update(state, x[:, c])
+
+    mean = np.array([state['mean'] for state in states])
+    loadings = np.array([state['components'][:components] for state in states])
+    singular_values = np.array([state['singular_values'][:components] for state in states])
+
+    # scores of early trials must use the final components, so project in a second pass
+    scores = np.concatenate([np.einsum('bcd,ckd->cbk', x - mean, loadings)
+                             for x in batches()], axis=1)
+
+    return mean, loadings, singular_values, scores, sum_squares
+
+
+def fit_randomized(batches, components, seed=0):
+    """
+    Randomized truncated SVD: the data is multiplied by random directions and refined by
+    power iterations, so only (trials x directions) and (directions x samples) matrices are
+    ever built. Takes 2 + 2 * power_iterations passes over the data.
+
+    Returns: tuple of (mean, components, singular values, scores, sum of squares) per channel
+
+    Parameter batches: returns a new iterator of (trials, channels, samples) batches on
+    every call
+    Precondition: batches must be callable
+
+    Parameter components: the number of components to keep
+    Precondition: components must be an int > 0
+
+    Parameter seed: seed of the random directions
+    Precondition: seed must be an int
+    """
+    rng = np.random.default_rng(seed)
+    omega = None
+    count = 0
+    total = None
+    sketch = []
+
+    # first pass: mean and the data times random directions (centered once the mean is known)
+    for x in batches():
+        if omega is None:
+            directions = min(components + oversamples, np.size(x, axis=2))
+            omega = rng.standard_normal((np.size(x, axis=1), np.size(x, axis=2), directions))
+            total = np.zeros(x.shape[1:])
+            sum_squares = np.zeros(np.size(x, axis=1))
+        count += np.size(x, axis=0)
+        total += x.sum(axis=0)
+        sum_squares += np.einsum('bcd,bcd->c', x, x)
+        sketch.append(np.einsum('bcd,cdl->cbl', x, omega))
+
+    mean = total / count
+    y = np.concatenate(sketch, axis=1) - np.einsum('cd,cdl->cl', mean, omega)[:, None]
+
+    for _ in range(power_iterations):
+        # (X - mean)^T Q, then (X - mean) times its orthonormal basis
+        q = orthonormal(y)
+        z = np.zeros(omega.shape[:2] + (np.size(q, axis=2),))
+        start = 0
+        for x in batches():
+            stop = start + np.size(x, axis=0)
+            z += np.einsum('bcd,cbl->cdl', x - mean, q[:, start:stop])
+            start = stop
+
+        z = orthonormal(z)
+        y = np.concatenate([np.einsum('bcd,cdl->cbl', x - mean, z) for x in batches()], axis=1)
+
+    # project the data onto the basis of its range and decompose the small result
+    q = orthonormal(y)
+    b = np.zeros((np.size(q, axis=0), np.size(q, axis=2), np.size(mean, axis=1)))
+    start = 0
+    for x in batches():
+        stop = start + np.size(x, axis=0)
+        b += np.einsum('cbl,bcd->cld', q[:, start:stop], x - mean)
+        start = stop
+
+    u, singular_values, vt = np.linalg.svd(b, full_matrices=False)
+    scores = np.einsum('cbl,clk->cbk', q, u[:, :, :components]) * \
+        singular_values[:, None, :components]
+
+    return mean, vt[:, :components], singular_values[:, :components], scores, sum_squares
+
+
+def fit(batches, components, method='incremental', seed=0):
+    """
+    Principal components of every channel, streaming the trials in batches so the full
+    (trials x samples) matrix is never built
+
+    Returns: dict with 'mean' (channels, samples), 'components' (channels, components,
+    samples), 'scores' (channels, trials, components), 'explained_variance' and
+    'explained_variance_ratio' (channels, components)
+
+    Parameter batches: returns a new iterator of (trials, channels, samples) batches on
+    every call, the trials in the same order each time
+    Precondition: batches must be callable
+
+    Parameter components: the number of components to keep
+    Precondition: components must be an int > 0
+
+    Parameter method: 'incremental' (2 passes) or 'randomized' (2 + 2 * power_iterations)
+    Precondition: method must be a String
+
+    Parameter seed: seed of the random directions of the randomized method
+    Precondition: seed must be an int
+    """
+    if method == 'incremental':
+        mean, loadings, singular_values, scores, sum_squares = fit_incremental(batches,
+                                                                               components)
+    elif method == 'randomized':
+        mean, loadings, singular_values, scores, sum_squares = fit_randomized(batches,
+                                                                              components, seed)
+    else:
+        raise ValueError('unknown PCA method: ' + str(method))
+
+    for c in range(np.size(loadings, axis=0)):
+        loadings[c], scores[c] = sign_flip(loadings[c], scores[c])
+
+    # variance of all samples of each channel, to report the share each component explains
+    count = np.size(scores, axis=1)
+    total_variance = (sum_squares - count * np.sum(mean ** 2, axis=1)) / max(count - 1, 1)
+
+    explained_variance = singular_values ** 2 / max(count - 1, 1)
+
+    return {'mean': mean,
+            'components': loadings,
+            'scores': scores,
+            'explained_variance': explained_variance,
+            'explained_variance_ratio': explained_variance / total_variance[:, None]}
@@ -0,0 +1,178 @@
+import os
+import time
+import threading
+from collections import deque
+import numpy as np
+import Instrumentation as ins
+
+# files read ahead of the one being processed; 0 turns prefetching off
+queue_depth = 2
+
+# bytes of file data held at once, counting the file being processed; a single file larger
+# than this is still read, alone
+memory_limit = 512 * 1024 ** 2
+
+# size of each sequential read; large reads keep network drives streaming
+block_size = 16 * 1024 ** 2
+
+# stall and read times of the last pipeline that finished (see prefetch)
+last_stats = None
+
+
+def read_file(path, state):
+    """
+    Returns: 1D numpy array of uint8 with every byte of a file, read front to back in
+    block_size reads, or None if the pipeline was stopped while reading
+
+    Parameter path: pathname of the file
+    Precondition: path must be a String
+
+    Parameter state: the pipeline state, checked between reads
+    Precondition: state must be a dict created by prefetch
+    """
+    buffer = np.empty(os.path.getsize(path), dtype=np.uint8)
+    view = memoryview(buffer)
+
+    # unbuffered, so every read goes straight from the file into the array
+    with open(path, 'rb', buffering=0) as f:
+        position = 0
+        while position < buffer.size:
+            if state['stop']:
+                return None
+            count = f.readinto(view[position:position + block_size])
+            if not count:
+                raise IOError('file shrank while it was read: ' + path)
+            position += count
+
+    return buffer
+
+
+def reader(paths, state):
+    """
+    Producer: reads the files one after another into memory, waiting whenever the queue is
+    full or the next file would not fit in the memory limit
+
+    Parameter paths: pathnames of the files in the order they are processed
+    Precondition: paths must be a list of Strings
+
+    Parameter state: the pipeline state shared with the consumer
+    Precondition: state must be a dict created by prefetch
+    """
+    condition = state['condition']
+    stats = state['stats']
+
+    try:
+        for path in paths:
+            size = os.path.getsize(path)
+
+            # wait for room; a file is always read once nothing else is held
+            with condition:
+                wait_start = time.perf_counter()
+                while not state['stop'] and (state['ahead'] >= state['depth'] or (
+                        state['held'] and state['held'] + size > state['memory'])):
+                    condition.wait()
+                stats['reader_stall_s'] += time.perf_counter() - wait_start
+                if state['stop']:
+                    return
+                state['ahead'] += 1
+                state['held'] += size
+
+            with ins.stage('prefetch read', path):
+                read_start = time.perf_counter()
+                buffer = read_file(path, state)
+                stats['read_s'] += time.perf_counter() - read_start
+            if buffer is None:
+                return
+
+            with condition:
+                stats['bytes_read'] += buffer.size
+                state['ready'].append((path, buffer))
+                condition.notify_all()
+    except BaseException as error:
+        # handed to the consumer, which raises it in its own thread
+        state['error'] = error
+    finally:
+        with condition:
+            state['done'] = True
+            condition.notify_all()
+
+
+def prefetch(paths, depth=None, memory=None):
+    """
+    Yields (path, buffer) for every file in order, where buffer is a 1D numpy array of uint8
+    holding the whole file. A reader thread reads the next files while the caller works on
+    the current one, so disk and compute overlap. A buffer counts against memory until the
+    caller asks for the next file.
+
+    When the pipeline finishes or is closed, last_stats holds the seconds spent reading
+    ('read_s'), the seconds the reader waited for room ('reader_stall_s'), the seconds the
+    caller waited for data ('compute_stall_s'), 'bytes_read' and 'files'.
+
+    Parameter paths: pathnames of the files in the order they are processed
+    Precondition: paths must be a list of Strings
+
+    Parameter depth: files to read ahead (defaults to queue_depth)
+    Precondition: depth must be None or an int >= 1
+
+    Parameter memory: bytes of file data to hold at once (defaults to memory_limit)
+    Precondition: memory must be None or an int > 0
+    """
+    global last_stats
+
+    stats = {'read_s': 0.0, 'reader_stall_s': 0.0, 'compute_stall_s': 0.0, 'bytes_read': 0,
+             'files': 0}
+    state = {'condition': threading.Condition(), 'ready': deque(), 'ahead': 0, 'held': 0,
+             'depth': depth or queue_depth or 1, 'memory': memory or memory_limit,
+             'stop': False, 'done': False, 'error': None, 'stats': stats}
+    condition = state['condition']
+
+    thread = threading.Thread(target=reader, args=(list(paths), state), daemon=True)
+    thread.start()
+
+    try:
+        for _ in paths:
+            # wait for the reader to hand over the next file
+            with condition, ins.stage('prefetch wait'):
+                wait_start = time.perf_counter()
+                while not state['ready'] and not state['done']:
+                    condition.wait()
+                stats['compute_stall_s'] += time.perf_counter() - wait_start
+                if not state['ready']:
+                    raise state['error'] or IOError('prefetch reader stopped early')
+                path, buffer = state['ready'].popleft()
+                state['ahead'] -= 1
+                condition.notify_all()
+
+            yield path, buffer
+            stats['files'] += 1
+
+            # the caller is done with this file, so its bytes no longer count
+            with condition:
+                state['held'] -= buffer.size
+                condition.notify_all()
+            del buffer
+    finally:
+        # stop the reader if the caller stopped early (e.g. the job was cancelled)
+        with condition:
+            state['stop'] = True
+            condition.notify_all()
+        thread.join()
+        last_stats = stats
+
+
+def summary(stats=None):
+    """
+    Returns: one line with the data read, the read time and how long each side of the
+    pipeline waited for the other
+
+    Parameter stats: the stats of a pipeline (defaults to last_stats)
+    Precondition: stats must be None or a dict like last_stats
+    """
+    stats = stats or last_stats
+    if stats is None:
+        return 'no prefetch pipeline has run'
+
+    return ('prefetched %d files, %.0f MB in %.2f s; reader waited %.2f s for room, '
+            'compute waited %.2f s for data' % (stats['files'], stats['bytes_read'] / 1024 ** 2,
+                                                stats['read_s'], stats['reader_stall_s'],
+                                                stats['compute_stall_s']))
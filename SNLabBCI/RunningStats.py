@@ -0,0 +1,59 @@
+import numpy as np
+
+
+def create():
+    """
+    Returns: dict holding the running state (count, mean, M2) of an empty accumulator
+    """
+    return {'count': 0, 'mean': None, 'm2': None}
+
+
+def update(stats, x):
+    """
+    Folds one trial into the running mean and sum of squared differences (Welford's method)
+
+    Parameter stats: the accumulator to update in place
+    Precondition: stats must be a dict returned by create
+
+    Parameter x: the data of one trial
+    Precondition: x must be a numpy array with the same shape for every update
+    """
+    if stats['count'] == 0:
+        stats['mean'] = np.zeros(np.shape(x))
+        stats['m2'] = np.zeros(np.shape(x))
+
+    stats['count'] += 1
+
+    delta = x - stats['mean']
+    stats['mean'] += delta / stats['count']
+    stats['m2'] += delta * (x - stats['mean'])
+
+
+def mean(stats):
+    """
+    Returns: numpy array with the mean of every trial folded in so far
+
+    Parameter stats: the accumulator
+    Precondition: stats must be a dict returned by create with at least one update
+    """
+    return stats['mean']
+
+
+def variance(stats):
+    """
+    Returns: numpy array with the population variance of every trial folded in so far
+
+    Parameter stats: the accumulator
+    Precondition: stats must be a dict returned by create with at least one update
+    """
+    return stats['m2'] / stats['count']
+
+
+def std(stats):
+    """
+    Returns: numpy array with the population standard deviation (same as np.std)
+
+    Parameter stats: the accumulator
+    Precondition: stats must be a dict returned by create with at least one update
+    """
+    return np.sqrt(variance(stats))
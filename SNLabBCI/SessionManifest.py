@@ -0,0 +1,155 @@
+import os
+import re
+import json
+import hashlib
+import numpy as np
+import ArrayCache as ac
+import TiffReader as tr
+
+# bump whenever the layout of a manifest changes so old manifests are rebuilt
+manifest_version = 1
+
+# folder that holds one manifest per tiff folder; kept apart from ArrayCache.cache_dir so
+# manifests are neither counted against the cache budget nor evicted with cached arrays
+manifest_dir = os.path.join(os.path.expanduser('~'), '.snlab_manifests')
+
+
+def natural_key(name):
+    """
+    Returns: sort key that orders numbers inside file names by value, so trial_2.tif comes
+    before trial_10.tif
+
+    Parameter name: the file name
+    Precondition: name must be a String
+    """
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r'(\d+)', name)]
+
+
+def manifest_path(tiff_dir):
+    """
+    Returns: pathname of the manifest of a tiff folder, kept in manifest_dir so the raw data
+    folder is never written to
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+    """
+    folder = hashlib.sha1(os.path.abspath(tiff_dir).encode()).hexdigest()
+
+    return os.path.join(manifest_dir, folder + '.json')
+
+
+def index_trial(tiff_dir, name, stat):
+    """
+    Returns: dict describing one trial file: name, size, modification time, page count,
+    page shape, sample dtype and the byte offset of every page (None when the pages cannot
+    be mapped directly, e.g. compressed files)
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+
+    Parameter name: file name of the trial
+    Precondition: name must be a String
+
+    Parameter stat: result of os.stat for the file
+    Precondition: stat must be an os.stat_result
+    """
+    info = tr.index_pages(tiff_dir + '/' + name)
+    offsets = tr.page_offsets(info)
+
+    return {'name': name, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns,
+            'frames': len(info['pages']), 'shape': list(info['shape']),
+            'dtype': None if info['dtype'] is None else info['dtype'].str,
+            'offsets': None if offsets is None else offsets.tolist()}
+
+
+def build(tiff_dir, previous=None):
+    """
+    Returns: manifest dict of a tiff folder with one entry per trial in natural file name
+    order. Entries of files whose name, size and modification time are unchanged are taken
+    from the previous manifest instead of reading the file again.
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+
+    Parameter previous: an earlier manifest of the same folder
+    Precondition: previous must be None or a dict returned by build
+    """
+    known = {}
+    if previous is not None and previous.get('version') == manifest_version:
+        known = {trial['name']: trial for trial in previous['trials']}
+
+    trials = []
+    for name in sorted((name for name in os.listdir(tiff_dir) if '.tif' in name),
+                       key=natural_key):
+        stat = os.stat(tiff_dir + '/' + name)
+        trial = known.get(name)
+
+        # a file is read again only if it is new or changed
+        if (trial is None or trial['size'] != stat.st_size
+                or trial['mtime_ns'] != stat.st_mtime_ns):
+            trial = index_trial(tiff_dir, name, stat)
+        trials.append(trial)
+
+    return {'version': manifest_version, 'tiff_dir': os.path.abspath(tiff_dir),
+            'trials': trials}
+
+
+def load(tiff_dir):
+    """
+    Returns: the manifest of a tiff folder, read from disk and refreshed for files that were
+    added, removed or changed since it was saved (only their stat is checked otherwise)
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+    """
+    path = manifest_path(tiff_dir)
+
+    previous = None
+    if os.path.exists(path):
+        try:
+            with open(path) as f:
+                previous = json.load(f)
+        except ValueError:
+            previous = None
+
+    manifest = build(tiff_dir, previous)
+
+    # save only when something changed
+    if ac.enabled and manifest != previous:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(manifest, f)
+        os.replace(path + '.tmp', path)
+
+    return manifest
+
+
+def paths(manifest):
+    """
+    Returns: list of pathnames of the trials, in trial order
+
+    Parameter manifest: the manifest of a tiff folder
+    Precondition: manifest must be a dict returned by load
+    """
+    return [manifest['tiff_dir'] + '/' + trial['name'] for trial in manifest['trials']]
+
+
+def read_trial(manifest, index):
+    """
+    Returns: 3D numpy array (frames, lines, pixels) with the raw samples of one trial,
+    mapped straight from the recorded page offsets without walking the file's IFDs again
+
+    Parameter manifest: the manifest of a tiff folder
+    Precondition: manifest must be a dict returned by load
+
+    Parameter index: zero-based trial index
+    Precondition: index must be an int
+    """
+    trial = manifest['trials'][index]
+    path = manifest['tiff_dir'] + '/' + trial['name']
+
+    # compressed or unusual layouts are decoded with PIL
+    if trial['offsets'] is None:
+        return tr.read_stack_pil(path)
+
+    return tr.map_pages(path, np.array(trial['offsets']), tuple(trial['shape']), trial['dtype'])
@@ -1,8 +1,18 @@
 import os
+import hashlib
+import functools
+import tempfile
 import numpy as np
-from PIL import Image
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import ArrayCache as ac
+import Instrumentation as ins
 import MetadataReader as mr
-import matplotlib.pyplot as plt
+import PCA as pc
+import Prefetch as pf
+import RunningStats as rs
+import SessionManifest as sm
+import TiffReader as tr
 
 # constants
 pixelps = 3.4 / 65536.0
@@ -16,21 +26,72 @@ spf = 0.294
 # milliseconds per line
 mspl = 1.15
 
+# bump whenever processing changes so stale cache entries are not reused
+pipeline_version = 3
+
+# number of worker processes used to ingest a folder of trials (1 = serial)
+num_workers = 1
+
+# dtype of normalized data and results (np.float32 halves memory, np.float64 matches the
+# original output); raw samples stay in their 16 bit form until they are reduced
+working_dtype = np.float64
+
+# called with (files done, total files) after each trial is ingested, e.g. by the GUI; it may
+# raise to stop the ingest
+progress_callback = None
+
+# standard deviations above a channel's mean that count as a photon
+photon_threshold = 3.8
+
+# number of lines photon counts are smoothed across (~100ms)
+photon_window = 100
+
+# frames per channel normalized and line averaged at a time when averaging during decode
+chunk_frames = 64
+
+# bytes of memory processing may use; when the normalized trials of a session do not fit,
+# tif_processor_run writes them to a disk-backed array instead (None = no limit)
+memory_budget = None
+
+# folder for disk-backed arrays (None = the system temporary folder)
+spill_dir = None
+
 
 def filter_channel(tif):
     """
-    Returns: 4D numpy array with an element for each channel
+    Returns: 4D numpy array view (channels, frames, lines, pixels) with an element for each
+    channel, no data is copied
 
     Parameter tif: the data to separate into channels
-    Precondition: tif must be 3D nested numpy array
+    Precondition: tif must be 3D numpy array or memmap with interleaved channel frames
     """
-    # separate channels
-    CH1 = tif[::4]
-    CH2 = tif[1::4]
-    CH3 = tif[2::4]
-    CH4 = tif[3::4]
+    # frames cycle through the 4 channels, so (frames, lines, pixels) is viewed as
+    # (frames / 4, 4, lines, pixels) and the channel axis moved to the front
+    num_frames = np.size(tif, axis=0) // 4
+    frames, lines, pixels = num_frames * 4, np.size(tif, axis=1), np.size(tif, axis=2)
 
-    return np.array([CH1, CH2, CH3, CH4])
+    return tif[:frames].reshape(num_frames, 4, lines, pixels).swapaxes(0, 1)
+
+
+def deinterleave(tif):
+    """
+    Separates a stack into channels and corrects the zig-zag recording pattern of the whole
+    stack with a single copy.
+
+    Returns: 4D numpy array (channels, frames, lines, pixels) in channel-major layout
+
+    Parameter tif: the raw stack (frames, lines, pixels)
+    Precondition: tif must be 3D numpy array or memmap with interleaved channel frames
+    """
+    channels = filter_channel(tif)
+
+    corrected = np.empty(channels.shape, dtype=channels.dtype)
+
+    # even lines are copied as recorded, odd lines are flipped on the way
+    corrected[:, :, ::2] = channels[:, :, ::2]
+    corrected[:, :, 1::2] = channels[:, :, 1::2, ::-1]
+
+    return corrected
 
 
 def average_line(data):
@@ -54,29 +115,23 @@ def average_trials(files, metadata_dir):
     Precondition: metadata_dir must be a String
     """
 
-    # list of lists grouped by angle: [file #, angle]
-    meta_data, temp = mr.read_metadata(metadata_dir)
+    # trial indices grouped by angle and the number of trials for each angle
+    meta_data, num_orientations = mr.read_metadata(metadata_dir)
 
-    # determine where to split array by cumulating orientations
-    temp = np.array(temp).cumsum()
+    # index of the first trial of each orientation in the reordered array
+    starts = np.concatenate(([0], np.cumsum(num_orientations)[:-1]))
 
-    # get rid of last element to split
-    sum_orientations = temp[:-1]
-    print(sum_orientations)
     # reorder array so it is grouped by angle
-    print(meta_data)
-    arr_reordered = np.take(files, meta_data, axis=0)
-
-    # split by orientation
-    arr_reordered = np.split(arr_reordered, sum_orientations)
+    with ins.stage('reorder trials'):
+        arr_reordered = np.take(files, meta_data, axis=0)
 
-    temp = []
-    for array in arr_reordered:
-        temp.append(np.mean(array, axis=0))
-    avgResult = np.array(temp)
+    # sum every orientation group in one pass and divide by the group sizes
+    with ins.stage('group sums'):
+        sums = np.add.reduceat(arr_reordered, starts, axis=0)
+    counts = np.array(num_orientations).reshape((-1,) + (1,) * (sums.ndim - 1))
 
     # return averaged numpy array
-    return avgResult
+    return sums / counts
 
 
 def average_all_orientations(trials):
@@ -91,59 +146,627 @@ def average_all_orientations(trials):
     return np.mean(trials, axis=0)
 
 
-def tif_processor_run(tiff_dir, metadata_dir):
+def report_progress(done, total):
+    """
+    Passes ingest progress on to progress_callback if one is set
+
+    Parameter done: number of files ingested so far
+    Precondition: done must be an int
+
+    Parameter total: number of files in the session
+    Precondition: total must be an int
+    """
+    if progress_callback is not None:
+        progress_callback(done, total)
+
+
+def list_tiffs(tiff_dir):
+    """
+    Returns: list of pathnames for the tif files in a folder, one per trial, in natural file
+    name order (trial_2 before trial_10) as recorded in the session manifest
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+    """
+    return sm.paths(sm.load(tiff_dir))
+
+
+def process_tiff(path, dtype=None, stack=None):
+    """
+    Reads one trial, corrects the zig-zag lines, separates channels and normalizes it.
+
+    Returns: 4D numpy array (channels, frames, lines, pixels) of normalized values
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+
+    Parameter dtype: float dtype of the result (defaults to working_dtype)
+    Precondition: dtype must be None or a numpy float dtype
+
+    Parameter stack: the raw frames if already read, e.g. by the prefetch pipeline
+    Precondition: stack must be None or a 3D numpy array (frames, lines, pixels)
+    """
+    if dtype is None:
+        dtype = working_dtype
+
+    with ins.stage('decode', path):
+        # map the raw frames (frames, lines, pixels) without decoding page by page
+        if stack is None:
+            stack = tr.read_stack(path)
+        ins.add_bytes_read(stack.nbytes)
+
+        # separate into 4 channels and correct for zig-zag recording pattern, still in the raw
+        # 16 bit form (reading the mapped pages happens here)
+        x = deinterleave(stack)
+
+    # normalize over each channel; extents are exact on the raw samples and the subtraction
+    # happens in the working dtype so signed samples cannot overflow
+    with ins.stage('extents', path):
+        x_min, x_max = x.min(axis=0, keepdims=True), x.max(axis=0, keepdims=True)
+
+    with ins.stage('cast and normalize', path):
+        normalized_data = np.subtract(x, x_min, dtype=dtype)
+        normalized_data /= np.subtract(x_max, x_min, dtype=dtype)
+
+    return normalized_data
+
+
+def process_lines(path, dtype=None, stack=None):
+    """
+    Reads one trial and averages each line while it is decoded, a few frames at a time, so
+    the full-resolution float array of the trial is never built.
+
+    Returns: 3D numpy array (channels, frames, lines) of normalized values averaged across
+    each line
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+
+    Parameter dtype: float dtype of the result (defaults to working_dtype)
+    Precondition: dtype must be None or a numpy float dtype
+
+    Parameter stack: the raw frames if already read, e.g. mapped from the session manifest
+    or read by the prefetch pipeline
+    Precondition: stack must be None or a 3D numpy array (frames, lines, pixels)
+    """
+    if dtype is None:
+        dtype = working_dtype
+
+    with ins.stage('decode and line average', path):
+        # map the raw frames (frames, lines, pixels) without decoding page by page
+        if stack is None:
+            stack = tr.read_stack(path)
+        _, lines, pixels = stack.shape
+        ins.add_bytes_read(stack.nbytes)
+        num_frames = np.size(stack, axis=0) // 4
+
+        averaged_by_line = np.empty((4, num_frames, lines), dtype=dtype)
+
+        for start in range(0, num_frames, chunk_frames):
+            stop = min(start + chunk_frames, num_frames)
+
+            # interleaved raw frames of the chunk as (frames, channels, lines, pixels)
+            chunk = stack[start * 4:stop * 4].reshape(stop - start, 4, lines, pixels)
+
+            # normalize over each channel, extents are taken on the raw samples
+            x_min, x_max = chunk.min(axis=1, keepdims=True), chunk.max(axis=1, keepdims=True)
+            chunk = np.subtract(chunk, x_min, dtype=dtype)
+            chunk /= np.subtract(x_max, x_min, dtype=dtype)
+
+            # average across each line, summing in float64 whatever the working dtype; the
+            # zig-zag flip only reorders pixels within a line, and the same way in every
+            # channel, so it does not change the result and is skipped
+            averaged_by_line[:, start:stop] = chunk.mean(axis=-1,
+                                                         dtype=np.float64).transpose(1, 0, 2)
+
+    return averaged_by_line
+
+
+def ingest_into_shared(shared_name, shape, index, path, average_lines, dtype):
+    """
+    Worker for parallel ingestion: processes one trial and writes it straight into its slot
+    of the shared output array so the floats never have to be pickled back.
+
+    Parameter shared_name: name of the shared memory block holding the output array
+    Precondition: shared_name must be a String
+
+    Parameter shape: the shape of the output array (trials, channels, frames, lines, pixels)
+    Precondition: shape must be a tuple of ints
+
+    Parameter index: the trial slot to fill
+    Precondition: index must be an int
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+
+    Parameter average_lines: write the line averaged trial instead of the full trial
+    Precondition: average_lines must be a boolean
+
+    Parameter dtype: float dtype of the output array
+    Precondition: dtype must be a numpy float dtype
+    """
+    shared = shared_memory.SharedMemory(name=shared_name)
+    try:
+        output = np.ndarray(shape, dtype=dtype, buffer=shared.buf)
+        if average_lines:
+            output[index] = process_lines(path, dtype)
+        else:
+            output[index] = process_tiff(path, dtype)
+        del output
+    finally:
+        shared.close()
+
+
+def frame_bytes(lines, pixels, raw_dtype, dtype):
+    """
+    Returns: bytes needed to normalize one frame of every channel
+
+    Parameter lines: lines per frame
+    Precondition: lines must be an int
+
+    Parameter pixels: pixels per line
+    Precondition: pixels must be an int
+
+    Parameter raw_dtype: dtype of the raw samples
+    Precondition: raw_dtype must be a numpy dtype
+
+    Parameter dtype: float dtype of the result
+    Precondition: dtype must be a numpy float dtype
+    """
+    raw = lines * pixels * np.dtype(raw_dtype).itemsize
+
+    # mapped raw pages and their de-interleaved copy (4 channels each), the two extents and
+    # the float range; the normalized values go straight to the output
+    return 4 * raw + 4 * raw + 2 * raw + lines * pixels * np.dtype(dtype).itemsize
+
+
+def frames_per_chunk(lines, pixels, raw_dtype, dtype, budget):
+    """
+    Returns: number of frames per channel that can be normalized at once within a budget
+
+    Parameter lines: lines per frame
+    Precondition: lines must be an int
+
+    Parameter pixels: pixels per line
+    Precondition: pixels must be an int
+
+    Parameter raw_dtype: dtype of the raw samples
+    Precondition: raw_dtype must be a numpy dtype
+
+    Parameter dtype: float dtype of the result
+    Precondition: dtype must be a numpy float dtype
+
+    Parameter budget: bytes the chunk may use
+    Precondition: budget must be an int
+    """
+    return max(1, budget // frame_bytes(lines, pixels, raw_dtype, dtype))
+
+
+def process_tiff_into(output, path, dtype, budget):
+    """
+    Reads one trial and writes it normalized into output a few frames at a time, so no more
+    than about budget bytes are held in memory. Gives exactly the values of process_tiff:
+    extents are per pixel across the 4 channels of a frame, so each chunk only needs its own.
+
+    Parameter output: where to write the trial, e.g. a slot of a disk-backed array
+    Precondition: output must be a 4D numpy array or memmap (channels, frames, lines, pixels)
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+
+    Parameter dtype: float dtype of the result
+    Precondition: dtype must be a numpy float dtype
+
+    Parameter budget: bytes a chunk may use
+    Precondition: budget must be an int
+    """
+    with ins.stage('decode and normalize chunked', path):
+        stack = tr.read_stack(path)
+        _, lines, pixels = stack.shape
+        ins.add_bytes_read(stack.nbytes)
+        num_frames = np.size(stack, axis=0) // 4
+
+        step = frames_per_chunk(lines, pixels, stack.dtype, dtype, budget)
+
+        for start in range(0, num_frames, step):
+            stop = min(start + step, num_frames)
+
+            # separate the chunk into channels and correct the zig-zag lines
+            x = deinterleave(stack[start * 4:stop * 4])
+
+            # normalize over each channel straight into the output
+            x_min, x_max = x.min(axis=0, keepdims=True), x.max(axis=0, keepdims=True)
+            chunk = output[:, start:stop]
+            np.subtract(x, x_min, dtype=dtype, out=chunk)
+            chunk /= np.subtract(x_max, x_min, dtype=dtype)
+
+
+def ingest_into_file(filename, index, path, dtype, budget):
+    """
+    Worker for out-of-core ingestion: processes one trial into its slot of a disk-backed
+    output array
+
+    Parameter filename: pathname of the .npy file holding the output array
+    Precondition: filename must be a String
+
+    Parameter index: the trial slot to fill
+    Precondition: index must be an int
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+
+    Parameter dtype: float dtype of the output array
+    Precondition: dtype must be a numpy float dtype
+
+    Parameter budget: bytes the worker may use
+    Precondition: budget must be an int
+    """
+    output = np.load(filename, mmap_mode='r+')
+    process_tiff_into(output[index], path, dtype, budget)
+    output.flush()
+    del output
+
+
+def ingest_out_of_core(paths, workers, dtype, budget):
+    """
+    Returns: 5D numpy memmap of processed trials, written to a disk-backed array in
+    spill_dir so the session never has to fit in memory
+
+    Parameter paths: pathnames of the tiff files in trial order
+    Precondition: paths must be a list of Strings
+
+    Parameter workers: number of worker processes
+    Precondition: workers must be an int >= 1
+
+    Parameter dtype: float dtype of the result
+    Precondition: dtype must be a numpy float dtype
+
+    Parameter budget: bytes processing may use across all workers
+    Precondition: budget must be an int
+    """
+    # all trials share the geometry of the first file
+    (frames, lines, pixels), raw_dtype = tr.stack_shape(paths[0])
+    shape = (len(paths), 4, frames // 4, lines, pixels)
+
+    # run only as many trials at once as the budget holds a frame of each
+    workers = max(1, min(workers, len(paths),
+                         budget // frame_bytes(lines, pixels, raw_dtype, dtype)))
+
+    fd, filename = tempfile.mkstemp(suffix='.npy', dir=spill_dir)
+    os.close(fd)
+
+    output = np.lib.format.open_memmap(filename, mode='w+', dtype=dtype, shape=shape)
+    try:
+        if workers > 1:
+            pool = ProcessPoolExecutor(max_workers=workers)
+            try:
+                jobs = [pool.submit(ingest_into_file, filename, i, path, dtype,
+                                    budget // workers)
+                        for i, path in enumerate(paths)]
+                for i, job in enumerate(jobs):
+                    job.result()
+                    report_progress(i + 1, len(paths))
+            finally:
+                # drop queued trials if ingest stopped early
+                pool.shutdown(cancel_futures=True)
+        else:
+            for i, path in enumerate(paths):
+                process_tiff_into(output[i], path, dtype, budget)
+                report_progress(i + 1, len(paths))
+        output.flush()
+    finally:
+        # the mapping stays valid once the file is removed (POSIX); elsewhere the file is
+        # left in spill_dir
+        try:
+            os.remove(filename)
+        except OSError:
+            pass
+
+    return output
+
+
+def ingest_parallel(paths, workers, average_lines, dtype):
+    """
+    Returns: 5D numpy array of processed trials (4D if average_lines), decoded by a pool of
+    worker processes
+
+    Parameter paths: pathnames of the tiff files in trial order
+    Precondition: paths must be a list of Strings
+
+    Parameter workers: number of worker processes
+    Precondition: workers must be an int > 1
+
+    Parameter average_lines: average each line during decode
+    Precondition: average_lines must be a boolean
+
+    Parameter dtype: float dtype of the result
+    Precondition: dtype must be a numpy float dtype
+    """
+    # all trials share the geometry of the first file
+    (frames, lines, pixels), _ = tr.stack_shape(paths[0])
+    shape = (len(paths), 4, frames // 4, lines) + (() if average_lines else (pixels,))
+
+    shared = shared_memory.SharedMemory(create=True,
+                                        size=int(np.prod(shape)) * np.dtype(dtype).itemsize)
+    pool = ProcessPoolExecutor(max_workers=workers)
+    try:
+        # each worker fills its own slot, results are only checked for errors
+        jobs = [pool.submit(ingest_into_shared, shared.name, shape, i, path, average_lines,
+                            dtype)
+                for i, path in enumerate(paths)]
+        for i, job in enumerate(jobs):
+            job.result()
+            report_progress(i + 1, len(paths))
+
+        # wait for every worker to let go of the shared block
+        pool.shutdown()
+
+        # copy out of shared memory so the block can be released
+        result = np.ndarray(shape, dtype=dtype, buffer=shared.buf).copy()
+    finally:
+        # drop queued trials if ingest stopped early
+        pool.shutdown(cancel_futures=True)
+        shared.close()
+        shared.unlink()
+
+    return result
+
+
+@ins.timed('ingest')
+def tif_processor_run(tiff_dir, metadata_dir, workers=None, average_lines=False, dtype=None):
     """
     Stores pixel values from a directory of tiff file into a numpy array.
 
-    Returns: 4D numpy array with pixel values separated into channels
+    Returns: 5D numpy array with pixel values separated into channels (a disk-backed memmap
+    when it would exceed memory_budget), or the 4D line averaged array (trials, channels,
+    frames, lines) when average_lines is True
 
     Parameter tiff_dir: filepath name for folder with tiff files
     Precondition: tiff_dir must be a String
 
     Parameter metadata_dir: filepath name for folder with metadata
     Precondition: metadata_dir must be a String
+
+    Parameter workers: number of processes to decode with (defaults to num_workers)
+    Precondition: workers must be None or an int >= 1
+
+    Parameter average_lines: average each line during decode so only the line averaged
+    array is ever allocated
+    Precondition: average_lines must be a boolean
+
+    Parameter dtype: float dtype of the result (defaults to working_dtype)
+    Precondition: dtype must be None or a numpy float dtype
     """
-    # initialize array to hold raw data from each frame
+    paths = list_tiffs(tiff_dir)
+
+    if workers is None:
+        workers = num_workers
+
+    # worker processes do not see changes to module settings, so the dtype is passed along
+    if dtype is None:
+        dtype = working_dtype
+
+    # write to a disk-backed array when the normalized trials would not fit in the budget
+    if memory_budget is not None and not average_lines and paths:
+        (frames, lines, pixels), _ = tr.stack_shape(paths[0])
+        if len(paths) * frames * lines * pixels * np.dtype(dtype).itemsize > memory_budget:
+            return ingest_out_of_core(paths, workers, dtype, memory_budget)
+
+    # spread the trials over a process pool when asked to
+    if workers > 1 and len(paths) > 1:
+        return ingest_parallel(paths, min(workers, len(paths)), average_lines, dtype)
+
+    if average_lines:
+        return np.array(list(iter_lines(paths, workers=1, dtype=dtype)))
+
     processed_tiffs = []
-    # loop through every tif file in folder
-    for tiff in os.listdir(tiff_dir):
-        # make sure it is a tif file
-        if ('.tif' in tiff):
-            # open tif file using PIL Image
-            with Image.open(tiff_dir + '/' + tiff) as img:
-                # initialize list to hold frames
-                frames = []
-                # loop through every frame
-                for i in range(img.n_frames):
-                    # go to right frame
-                    img.seek(i)
-                    # make frame data into array of floats
-                    frame = np.array(img).astype(float)
+    for i, (path, stack) in enumerate(read_stacks(paths)):
+        processed_tiffs.append(process_tiff(path, dtype, stack))
+        report_progress(i + 1, len(paths))
 
-                    # correct for zig-zag recording pattern by flipping every other line
-                    frame[1::2, :] = frame[1::2, ::-1]
+    return np.array(processed_tiffs)
 
-                    # append frame data array to frames list
-                    frames.append(frame)
 
-                # append frames array to processed tif files list
-                processed_tiffs.append(np.array(frames))
+def read_stacks(paths):
+    """
+    Yields (path, raw frames) for each trial in trial order. While one trial is processed,
+    the prefetch pipeline reads the next pf.queue_depth files in large sequential reads, so
+    the disk is never idle while numpy works. The frames are None when prefetching is off
+    (pf.queue_depth is 0) and each trial maps its own file.
 
-    np.array(processed_tiffs)
+    Parameter paths: pathnames of the tiff files in trial order
+    Precondition: paths must be a list of Strings
+    """
+    if pf.queue_depth <= 0:
+        for path in paths:
+            yield path, None
+        return
 
-    temp = []
-    for tif in processed_tiffs:
-        # for each tif: separate into 4 channels
-        temp.append(filter_channel(tif))
+    for path, buffer in pf.prefetch(paths):
+        # index and view the pages in place, the bytes are already in memory
+        yield path, tr.read_stack_buffer(buffer)
 
-    x = np.array(temp)
 
-    # normalize over each channel
-    x_min, x_max = x.min(axis=1, keepdims=True), x.max(axis=1, keepdims=True)
+def map_trials(function, paths, workers=None, dtype=None):
+    """
+    Yields function(path, dtype) for each trial in trial order as soon as it is ready, on a
+    process pool when more than one worker is used. A single worker is fed by the prefetch
+    pipeline (see read_stacks).
 
-    normalized_data = (x - x_min) / (x_max - x_min)
+    Parameter function: per-trial processing function, must be defined at module level
+    Precondition: function must take (path, dtype, stack=None) and return a small result
 
-    return normalized_data
+    Parameter paths: pathnames of the tiff files in trial order
+    Precondition: paths must be a list of Strings
+
+    Parameter workers: number of processes to decode with (defaults to num_workers)
+    Precondition: workers must be None or an int >= 1
+
+    Parameter dtype: float dtype of the results (defaults to working_dtype)
+    Precondition: dtype must be None or a numpy float dtype
+    """
+    if workers is None:
+        workers = num_workers
+
+    # worker processes do not see changes to module settings, so the dtype is passed along
+    if dtype is None:
+        dtype = working_dtype
+
+    if workers > 1 and len(paths) > 1:
+        # results are small enough to send back from the workers directly
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(paths)))
+        try:
+            for i, result in enumerate(pool.map(function, paths, [dtype] * len(paths))):
+                report_progress(i + 1, len(paths))
+                yield result
+        finally:
+            # drop queued trials if the caller stops early (e.g. the job was cancelled)
+            pool.shutdown(cancel_futures=True)
+    else:
+        for i, (path, stack) in enumerate(read_stacks(paths)):
+            result = function(path, dtype, stack)
+            report_progress(i + 1, len(paths))
+            yield result
+
+
+def iter_lines(paths, workers=None, dtype=None):
+    """
+    Yields the line averaged data of each trial in trial order as soon as it is decoded,
+    so only one full-resolution trial per worker is held in memory at a time
+
+    Parameter paths: pathnames of the tiff files in trial order
+    Precondition: paths must be a list of Strings
+
+    Parameter workers: number of processes to decode with (defaults to num_workers)
+    Precondition: workers must be None or an int >= 1
+
+    Parameter dtype: float dtype of the results (defaults to working_dtype)
+    Precondition: dtype must be None or a numpy float dtype
+    """
+    return map_trials(process_lines, paths, workers, dtype)
+
+
+def processing_params():
+    """
+    Returns: dict of the settings that change processed output, used to key the cache
+    """
+    return {'pipeline': pipeline_version, 'dtype': np.dtype(working_dtype).name}
+
+
+def photon_params():
+    """
+    Returns: dict of the settings that change photon counts, used to key cached counts
+    """
+    return dict(processing_params(), photon_threshold=photon_threshold,
+                photon_window=photon_window)
+
+
+def load_trials(tiff_dir, metadata_dir):
+    """
+    Returns: 5D numpy array of normalized trials, read from the cache when the folder has
+    already been processed
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+
+    Parameter metadata_dir: filepath name for folder with metadata
+    Precondition: metadata_dir must be a String
+    """
+    key = ac.session_key(list_tiffs(tiff_dir), processing_params())
+
+    data = ac.load(key, 'normalized')
+    if data is None:
+        data = tif_processor_run(tiff_dir, metadata_dir)
+        ac.store(key, 'normalized', data)
+
+    return data
+
+
+def load_lines(tiff_dir, metadata_dir):
+    """
+    Returns: 4D numpy array of normalized trials averaged across each line, read from the
+    cache when the folder has already been processed
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+
+    Parameter metadata_dir: filepath name for folder with metadata
+    Precondition: metadata_dir must be a String
+    """
+    key = ac.session_key(list_tiffs(tiff_dir), processing_params())
+
+    data = ac.load(key, 'lines')
+    if data is None:
+        data = session_statistics(tiff_dir, metadata_dir)['lines']
+
+    return data
+
+
+def trial_groups(metadata_dir, num_trials):
+    """
+    Returns: 1D numpy array with the orientation group index of every trial, -1 for trials
+    the metadata does not list
+
+    Parameter metadata_dir: filepath name for folder with metadata
+    Precondition: metadata_dir must be a String
+
+    Parameter num_trials: the number of trials in the session
+    Precondition: num_trials must be an int
+    """
+    # trial indices grouped by angle and the number of trials for each angle
+    meta_data, num_orientations = mr.read_metadata(metadata_dir)
+
+    groups = np.full(num_trials, -1)
+    groups[meta_data] = np.repeat(np.arange(len(num_orientations)), num_orientations)
+
+    return groups
+
+
+@ins.timed('session statistics')
+def session_statistics(tiff_dir, metadata_dir, grouped=False):
+    """
+    Streams every trial of a session through running (Welford) accumulators, overall and
+    per orientation, so the full 5D stack is never built.
+
+    Returns: dict with 'lines' (4D numpy array of line averaged trials), 'overall' (the
+    running statistics across all trials) and 'groups' (a list of running statistics for
+    each orientation, only filled when grouped is True)
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+
+    Parameter metadata_dir: filepath name for folder with metadata
+    Precondition: metadata_dir must be a String
+
+    Parameter grouped: also accumulate statistics per orientation
+    Precondition: grouped must be a boolean
+    """
+    paths = list_tiffs(tiff_dir)
+    key = ac.session_key(paths, processing_params())
+
+    # line averages are read back from the cache when available, else decoded trial by trial
+    cached = ac.load(key, 'lines')
+    source = iter_lines(paths) if cached is None else cached
+
+    groups = trial_groups(metadata_dir, len(paths)) if grouped else None
+    group_stats = [rs.create() for _ in range(groups.max() + 1)] if grouped else []
+    overall = rs.create()
+
+    lines = []
+    for i, trial in enumerate(source):
+        # fold the trial in as soon as it is available
+        rs.update(overall, trial)
+        if grouped and groups[i] >= 0:
+            rs.update(group_stats[groups[i]], trial)
+        lines.append(trial)
+
+    if cached is None:
+        lines = np.array(lines)
+        ac.store(key, 'lines', lines)
+    else:
+        lines = cached
+
+    return {'lines': lines, 'overall': overall, 'groups': group_stats}
 
 
 def average(tiff_dir, metadata_dir):
@@ -157,14 +780,11 @@ def average(tiff_dir, metadata_dir):
     Precondition: metadata_dir must be a String
     """
 
-    # process tiffs and separate them into 4 channels
-    tiff_by_channel = tif_processor_run(tiff_dir, metadata_dir)
-
-    # average across each line
-    averaged_by_line = average_line(tiff_by_channel)
+    # stream trials through running statistics for each orientation
+    stats = session_statistics(tiff_dir, metadata_dir, grouped=True)
 
     # averages within orientations
-    averages = average_trials(averaged_by_line, metadata_dir)
+    averages = np.array([rs.mean(group) for group in stats['groups']], dtype=working_dtype)
 
     return averages
 
@@ -179,24 +799,23 @@ def baseline(tiff_dir, metadata_dir):
     Parameter metadata_dir: filepath name for folder with metadata
     Precondition: metadata_dir must be a String
     """
-    # process tiffs and separate them into 4 channels
-    tiff_by_channel = tif_processor_run(tiff_dir, metadata_dir)
-
-    # average across each line
-    averaged_by_line = average_line(tiff_by_channel)
+    # stream trials through running statistics
+    stats = session_statistics(tiff_dir, metadata_dir)
 
     # averages across all trials
-    averages = average_all_orientations(averaged_by_line)
+    averages = rs.mean(stats['overall']).astype(working_dtype)
 
     return averages
 
 
 def single_trial(trials, tiff_dir, metadata_dir):
     """
-    Returns: 4D numpy array with selected trials
+    Returns: 4D numpy array with selected trials, averaged across each line. Only the
+    selected files are read unless the whole session is already cached; normalization
+    extents are per trial, so no other trial is needed.
 
-    Parameter trials: the trial indices to plot
-    Precondition: files must be 4D nested numpy array
+    Parameter trials: the zero-based trial indices to plot
+    Precondition: trials must be a list of ints
 
     Parameter tiff_dir: filepath name for folder with tiff files
     Precondition: tiff_dir must be a String
@@ -204,17 +823,19 @@ def single_trial(trials, tiff_dir, metadata_dir):
     Parameter metadata_dir: filepath name for folder with metadata
     Precondition: metadata_dir must be a String
     """
+    manifest = sm.load(tiff_dir)
+    paths = sm.paths(manifest)
 
-    # process tiffs and separate them into 4 channels
-    all_trials = tif_processor_run(tiff_dir, metadata_dir)
+    # select trials we need from the cached line averages of the whole session
+    cached = ac.load(ac.session_key(paths, processing_params()), 'lines')
+    if cached is not None:
+        return np.take(cached, trials, axis=0)
 
-    # average across each line
-    averaged_by_line = average_line(all_trials)
+    # otherwise map and line average only the chosen files, straight from their page offsets
+    selected_trials = [process_lines(paths[i], stack=sm.read_trial(manifest, i))
+                       for i in trials]
 
-    # select trials we need from list of indices
-    selected_trials = np.take(averaged_by_line, trials, axis=0)
-
-    return selected_trials
+    return np.array(selected_trials, dtype=working_dtype)
 
 
 def trial_against_experiment(tiff_dir, metadata_dir):
@@ -227,14 +848,11 @@ def trial_against_experiment(tiff_dir, metadata_dir):
     Parameter metadata_dir: filepath name for folder with metadata
     Precondition: metadata_dir must be a String
     """
-    # processes tiffs and separates them into 4 channels
-    tiff_by_channel = tif_processor_run(tiff_dir, metadata_dir)
-
-    # average across each line
-    averaged_by_line = average_line(tiff_by_channel)
+    # process tiffs, separate them into 4 channels and average across each line
+    averaged_by_line = load_lines(tiff_dir, metadata_dir)
 
     # flatten each channel (new shape should be (# trials, # channels, # data points))
-    tiff_by_channel = averaged_by_line.reshape(np.size(tiff_by_channel, 0), 4, 5376)
+    tiff_by_channel = averaged_by_line.reshape(np.size(averaged_by_line, 0), 4, 5376)
 
     # average each trial for each channel
     average = np.mean(tiff_by_channel, axis=2)
@@ -253,17 +871,14 @@ def standard_deviation(tiff_dir, metadata_dir):
     Precondition: metadata_dir must be a String
     """
 
-    # processes tiffs and separates them into 4 channels
-    tiff_by_channel = tif_processor_run(tiff_dir, metadata_dir)
-
-    # average across each line
-    averaged_by_line = average_line(tiff_by_channel)
+    # stream trials through running statistics
+    stats = session_statistics(tiff_dir, metadata_dir)
 
     # averages across all trials
-    average_across_trials = average_all_orientations(averaged_by_line)
+    average_across_trials = rs.mean(stats['overall']).astype(working_dtype)
 
     # calculate standard deviation of each line
-    std_across_trials = np.std(averaged_by_line, axis=0)
+    std_across_trials = rs.std(stats['overall']).astype(working_dtype)
 
     # return average, std arrays
     return average_across_trials, std_across_trials
@@ -280,16 +895,14 @@ def separate_trials(tiff_dir, metadata_dir):
     Parameter metadata_dir: filepath name for folder with metadata
     Precondition: metadata_dir must be a String
     """
-    # processes tiffs and separates them into 4 channels
-    tiff_by_channel = tif_processor_run(tiff_dir, metadata_dir)
-
-    # average across each line
-    averaged_by_line = average_line(tiff_by_channel)
+    # process tiffs, separate them into 4 channels and average across each line
+    averaged_by_line = load_lines(tiff_dir, metadata_dir)
 
     # return the data separated into trials
     return averaged_by_line
 
 
+@ins.timed('run all')
 def run_all(tiff_dir, metadata_dir):
     """
     Returns: Four 3D numpy arrays containing data to plot separate trials, standard deviations, and
@@ -301,66 +914,106 @@ def run_all(tiff_dir, metadata_dir):
     Parameter metadata_dir: filepath name for folder with metadata
     Precondition: metadata_dir must be a String
     """
-    # process and unpack std data
-    data_avg, std_data = standard_deviation(tiff_dir, metadata_dir)
+    # process tiffs once, folding each trial into the running statistics as it is decoded
+    stats = session_statistics(tiff_dir, metadata_dir)
+    averaged_by_line = stats['lines']
+
+    # mean and std across trials; the baseline is the same cross-trial mean
+    data_avg = rs.mean(stats['overall']).astype(working_dtype)
+    std_data = rs.std(stats['overall']).astype(working_dtype)
+    baseline_data = data_avg
 
     # trial-by-trial, std, baseline
-    return separate_trials(tiff_dir, metadata_dir), data_avg, std_data, baseline(tiff_dir,
-                                                                                 metadata_dir)
+    return averaged_by_line, data_avg, std_data, baseline_data
 
 
-def photon_count(tiff_dir, metadata_dir):
+def photon_thresholds(trial):
     """
-    Returns: 2D numpy array that is filtered for only above threshold events and smoothed to ~100ms
+    Returns: 1D numpy array with the photon threshold of each channel of a trial (mean plus
+    photon_threshold standard deviations)
 
-    Parameter tiff_dir: filepath name for folder with tiff files
-    Precondition: tiff_dir must be a String
+    Parameter trial: normalized data of one trial
+    Precondition: trial must be a 4D numpy array (channels, frames, lines, pixels)
+    """
+    # flatten each channel to calculate its mean and standard deviation
+    samples = trial.reshape(np.size(trial, axis=0), -1)
 
-    Parameter metadata_dir: filepath name for folder with metadata
-    Precondition: metadata_dir must be a String
+    mean = np.mean(samples, axis=1, dtype=np.float64)
+    std = np.std(samples, axis=1, dtype=np.float64)
+
+    return mean + photon_threshold * std
+
+
+@ins.timed('photon count')
+def count_photons(trial):
     """
-    # process data
-    data = tif_processor_run(tiff_dir, metadata_dir)
+    Returns: 3D numpy array (channels, frames, lines) with the number of samples above the
+    channel's threshold in every line
+
+    Parameter trial: normalized data of one trial
+    Precondition: trial must be a 4D numpy array (channels, frames, lines, pixels)
+    """
+    threshold = photon_thresholds(trial)
+
+    counts = np.empty(trial.shape[:-1], dtype=np.int64)
 
-    # reshape array to calculate mean of each channel
-    new_data = data.reshape(np.size(data, axis=0), np.size(data, axis=1),
-                            np.size(data, axis=2) * np.size(data, axis=3) * np.size(data, axis=4))
+    # compare a few frames at a time so only a small boolean mask exists at once
+    for start in range(0, np.size(trial, axis=1), chunk_frames):
+        chunk = trial[:, start:start + chunk_frames]
+        np.sum(chunk > threshold[:, None, None, None], axis=-1,
+               out=counts[:, start:start + chunk_frames])
 
-    # calculate mean and standard deviation of each channel
-    mean = np.mean(new_data, axis=2)
-    std = np.std(new_data, axis=2)
+    return counts
 
-    # calculate threshold (3.8 std right now)
-    threshold = mean + 3.8 * std
 
-    # only keep data above the threshold
-    data = np.where(data > threshold[0][0], data, 0)
+def process_photons(path, dtype=None, stack=None):
+    """
+    Returns: 3D numpy array (channels, frames, lines) of photon counts per line for one trial
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+
+    Parameter dtype: float dtype used while normalizing (defaults to working_dtype)
+    Precondition: dtype must be None or a numpy float dtype
+
+    Parameter stack: the raw frames if already read, e.g. by the prefetch pipeline
+    Precondition: stack must be None or a 3D numpy array (frames, lines, pixels)
+    """
+    return count_photons(process_tiff(path, dtype, stack))
 
-    # count the number of points above the threshold for each line
-    data = np.count_nonzero(data, axis=4)
 
-    # reshape
-    data = data.reshape(np.size(data, axis=0), np.size(data, axis=1),
-                        np.size(data, axis=2) * np.size(data, axis=3))
+def photon_count(tiff_dir, metadata_dir):
+    """
+    Returns: 3D numpy array (trials, channels, time) of above threshold events per line,
+    smoothed to ~100ms
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+
+    Parameter metadata_dir: filepath name for folder with metadata
+    Precondition: metadata_dir must be a String
+    """
+    paths = list_tiffs(tiff_dir)
+    key = ac.session_key(paths, photon_params())
 
-    # initialize list to hold processed data
-    avg = []
+    # count events trial by trial (thresholds are per trial and channel)
+    counts = ac.load(key, 'photons')
+    if counts is None:
+        counts = np.array(list(map_trials(process_photons, paths)))
+        ac.store(key, 'photons', counts)
 
-    # iterate through each trial and calculate the moving avg for each channel
-    for trial in data:
-        # calculate moving average
-        CH1 = moving_average(trial[0], 100)
-        CH2 = moving_average(trial[1], 100)
-        CH3 = moving_average(trial[2], 100)
-        CH4 = moving_average(trial[3], 100)
-        avg.append(np.array([CH1, CH2, CH3, CH4]))
+    # reshape to (trials, channels, lines in time order)
+    counts = counts.reshape(np.size(counts, axis=0), np.size(counts, axis=1), -1)
 
-    return np.array(avg)
+    # smooth every trial and channel at once
+    return moving_average(counts, photon_window).astype(working_dtype)
 
 
+@ins.timed('moving average')
 def moving_average(x, w):
     """
-    Returns: a numpy array that is calculated using the moving average
+    Returns: a numpy array that is calculated using the moving average along the last axis
+    (same values as np.convolve(x, np.ones(w), 'valid') / w for each row)
 
     Parameter x: the numpy array of data to calculate the moving average from
     Precondition: x must be a numpy array of ints, floats, or doubles
@@ -368,24 +1021,177 @@ def moving_average(x, w):
     Parameter w: the window size to smooth across
     Precondition: w must be an int
     """
-    return np.convolve(x, np.ones(w), 'valid') / w
+    # running sum with a leading zero, so each window is the difference of two sums
+    cumulative = np.zeros(x.shape[:-1] + (np.size(x, axis=-1) + 1,))
+    np.cumsum(x, axis=-1, out=cumulative[..., 1:])
 
+    return (cumulative[..., w:] - cumulative[..., :-w]) / w
 
-def pca(tiff_dir, metadata_dir):
-    # process data
-    data = tif_processor_run(tiff_dir, metadata_dir)
 
-    # reshape
-    data = data.reshape(np.size(data, axis=0), np.size(data, axis=1),
-                        np.size(data, axis=2) * np.size(data, axis=3) * np.size(data, axis=4))
+def process_noise_adjusted(path, dtype=None, stack=None, noise=None):
+    """
+    Reads and normalizes one trial, subtracts the noise baseline from every sample and
+    takes the line averages and photon counts of the corrected trial while it is in memory
 
-    return data
+    Returns: tuple of the line averages and the photon counts per line, both 3D numpy arrays
+    (channels, frames, lines)
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+
+    Parameter dtype: float dtype used while normalizing (defaults to working_dtype)
+    Precondition: dtype must be None or a numpy float dtype
+
+    Parameter stack: the raw frames if already read, e.g. by the prefetch pipeline
+    Precondition: stack must be None or a 3D numpy array (frames, lines, pixels)
+
+    Parameter noise: line averaged noise of every channel, one value per line of the trial
+    Precondition: noise must be a numpy array with channels * frames * lines values
+    """
+    trial = process_tiff(path, dtype, stack)
+
+    with ins.stage('noise subtraction', path):
+        # the baseline holds one value per line, taken off every pixel of that line
+        trial -= np.reshape(noise, trial.shape[:-1])[..., None].astype(trial.dtype)
+
+        # average across each line, summing in float64 whatever the working dtype
+        lines = trial.mean(axis=-1, dtype=np.float64).astype(trial.dtype)
+
+    return lines, count_photons(trial)
+
+
+@ins.timed('noise adjusted statistics')
+def noise_adjusted(tiff_dir, metadata_dir, noise):
+    """
+    Subtracts a noise baseline from every trial as it streams through, so the corrected line
+    averages, their mean and std across trials and the photon counts all come from one pass
+    over the raw files.
+
+    Returns: dict with 'lines' (4D numpy array of corrected line averaged trials), 'average'
+    and 'std' (3D numpy arrays across all trials) and 'photon_counts' (3D numpy array
+    (trials, channels, time) smoothed like photon_count)
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+
+    Parameter metadata_dir: filepath name for folder with metadata
+    Precondition: metadata_dir must be a String
+
+    Parameter noise: line averaged noise of every channel, e.g. from the baseline library
+    Precondition: noise must be a numpy array with channels * frames * lines values
+    """
+    paths = list_tiffs(tiff_dir)
+    noise = np.ascontiguousarray(noise, dtype=np.float64)
+
+    # results depend on the baseline and the photon settings, so they are part of the cache key
+    params = dict(photon_params(), noise=hashlib.sha1(noise.tobytes()).hexdigest())
+    key = ac.session_key(paths, params)
+
+    # corrected trials are read back from the cache when available, else decoded one by one
+    cached_lines, cached_counts = ac.load(key, 'noise_lines'), ac.load(key, 'noise_photons')
+    cached = cached_lines is not None and cached_counts is not None
+    if cached:
+        source = zip(cached_lines, cached_counts)
+    else:
+        source = map_trials(functools.partial(process_noise_adjusted, noise=noise), paths)
+
+    overall = rs.create()
+    lines, counts = [], []
+    for trial_lines, trial_counts in source:
+        # fold the corrected trial in as soon as it is available
+        rs.update(overall, trial_lines)
+        lines.append(trial_lines)
+        counts.append(trial_counts)
+
+    if cached:
+        lines, counts = cached_lines, cached_counts
+    else:
+        lines, counts = np.array(lines), np.array(counts)
+        ac.store(key, 'noise_lines', lines)
+        ac.store(key, 'noise_photons', counts)
+
+    # reshape counts to (trials, channels, lines in time order) and smooth them
+    counts = counts.reshape(np.size(counts, axis=0), np.size(counts, axis=1), -1)
+
+    return {'lines': lines,
+            'average': rs.mean(overall).astype(working_dtype),
+            'std': rs.std(overall).astype(working_dtype),
+            'photon_counts': moving_average(counts, photon_window).astype(working_dtype)}
+
+
+def trial_batches(tiff_dir):
+    """
+    Returns: function that yields the normalized trials of a folder in batches of
+    pc.batch_trials, each a 3D numpy array (trials, channels, frames * lines * pixels). Every
+    call starts a new pass, reading the cached trials when the folder has been processed.
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+    """
+    paths = list_tiffs(tiff_dir)
+    key = ac.session_key(paths, processing_params())
+
+    def batches():
+        cached = ac.load(key, 'normalized')
+        source = iter(cached) if cached is not None else map_trials(process_tiff, paths)
+
+        batch = []
+        for trial in source:
+            # flatten every channel of the trial into one row of samples
+            batch.append(np.reshape(trial, (np.size(trial, axis=0), -1)))
+            if len(batch) == pc.batch_trials:
+                yield np.array(batch, dtype=np.float64)
+                batch = []
+        if batch:
+            yield np.array(batch, dtype=np.float64)
+
+    return batches
+
+
+def pca(tiff_dir, metadata_dir, components=3, method='incremental'):
+    """
+    Returns: dict with the principal components of every channel across the trials of a
+    session (see PCA.fit): 'mean', 'components' (loadings), 'scores' (one row per trial),
+    'explained_variance' and 'explained_variance_ratio'
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+
+    Parameter metadata_dir: filepath name for folder with metadata
+    Precondition: metadata_dir must be a String
+
+    Parameter components: the number of components to keep
+    Precondition: components must be an int > 0
+
+    Parameter method: 'incremental' or 'randomized'
+    Precondition: method must be a String
+    """
+    # trials are streamed in batches on every pass, so the session never has to fit in memory
+    return pc.fit(trial_batches(tiff_dir), components, method)
+
+
+def first_frame(tiff_dir, metadata_dir):
+    """
+    Returns: 2D numpy array (lines, pixels) with the first frame of the first channel of the
+    first trial, the frame histogramFrame draws
+
+    Parameter tiff_dir: filepath name for folder with tiff files
+    Precondition: tiff_dir must be a String
+
+    Parameter metadata_dir: filepath name for folder with metadata
+    Precondition: metadata_dir must be a String
+    """
+    # copied out of the (possibly memory mapped) trials
+    return np.array(load_trials(tiff_dir, metadata_dir)[0][0][0])
 
 
 def histogramFrame(tiff_dir, metadata_dir):
+    # imported here so ingest workers do not pay for pyplot
+    import matplotlib.pyplot as plt
+
     # process data
-    data = tif_processor_run(tiff_dir, metadata_dir)
+    data = first_frame(tiff_dir, metadata_dir)
 
-    plt.hist(data[0][0][0])
+    plt.hist(data)
 
     plt.show()
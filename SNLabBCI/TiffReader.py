@@ -0,0 +1,284 @@
+import io
+import mmap
+import struct
+import numpy as np
+
+# tiff tags used to locate the pixel data of each page
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+STRIP_BYTE_COUNTS = 279
+TILE_WIDTH = 322
+SAMPLE_FORMAT = 339
+
+# size in bytes and struct code of each tiff field type
+field_types = {1: (1, 'B'), 2: (1, 'B'), 3: (2, 'H'), 4: (4, 'I'), 5: (8, 'II'),
+               6: (1, 'b'), 7: (1, 'B'), 8: (2, 'h'), 9: (4, 'i'), 10: (8, 'ii'),
+               11: (4, 'f'), 12: (8, 'd'), 16: (8, 'Q'), 17: (8, 'q'), 18: (8, 'Q')}
+
+# numpy kind for each tiff sample format (1: unsigned, 2: signed, 3: float)
+sample_kinds = {1: 'u', 2: 'i', 3: 'f'}
+
+
+def read_tag(buffer, byteorder, entry, bigtiff):
+    """
+    Returns: tuple of (tag, list of values) for a single IFD entry
+
+    Parameter buffer: the bytes of the tiff file (memory mapped or read into memory)
+    Precondition: buffer must support the buffer protocol
+
+    Parameter byteorder: struct byte order character of the file
+    Precondition: byteorder must be '<' or '>'
+
+    Parameter entry: byte offset of the IFD entry
+    Precondition: entry must be an int
+
+    Parameter bigtiff: whether the file is a BigTIFF
+    Precondition: bigtiff must be a boolean
+    """
+    if bigtiff:
+        tag, kind, count = struct.unpack_from(byteorder + 'HHQ', buffer, entry)
+        value_offset, inline_size = entry + 12, 8
+    else:
+        tag, kind, count = struct.unpack_from(byteorder + 'HHI', buffer, entry)
+        value_offset, inline_size = entry + 8, 4
+
+    # unknown field types are skipped
+    if kind not in field_types:
+        return tag, []
+
+    size, code = field_types[kind]
+
+    # values that do not fit in the entry are stored at an offset elsewhere in the file
+    if size * count > inline_size:
+        value_offset = struct.unpack_from(byteorder + ('Q' if bigtiff else 'I'), buffer,
+                                          value_offset)[0]
+
+    return tag, list(struct.unpack_from(byteorder + code * count, buffer, value_offset))
+
+
+def index_pages(path):
+    """
+    Walks the IFD chain of a tiff file once and records where each page's pixel data lives.
+
+    Returns: dict with the sample dtype (None for samples that are not 8, 16, 32 or 64 bits),
+    page shape (lines, pixels), compression and a list of (strip offsets, strip byte counts)
+    tuples for every page
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+    """
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+        return index_buffer(buffer)
+
+
+def index_buffer(buffer):
+    """
+    Returns: the page index of a tiff file held in memory (see index_pages)
+
+    Parameter buffer: the bytes of the whole tiff file, e.g. a memory map or a prefetched copy
+    Precondition: buffer must support the buffer protocol
+    """
+    # header: byte order, magic number and offset of the first IFD
+    byteorder = '<' if bytes(buffer[:2]) == b'II' else '>'
+    bigtiff = struct.unpack_from(byteorder + 'H', buffer, 2)[0] == 43
+
+    if bigtiff:
+        ifd = struct.unpack_from(byteorder + 'Q', buffer, 8)[0]
+    else:
+        ifd = struct.unpack_from(byteorder + 'I', buffer, 4)[0]
+
+    info = None
+    pages = []
+
+    # follow the chain of IFDs until the next offset is 0
+    while ifd:
+        if bigtiff:
+            num_entries = struct.unpack_from(byteorder + 'Q', buffer, ifd)[0]
+            first_entry, entry_size, pointer = ifd + 8, 20, 'Q'
+        else:
+            num_entries = struct.unpack_from(byteorder + 'H', buffer, ifd)[0]
+            first_entry, entry_size, pointer = ifd + 2, 12, 'I'
+
+        tags = dict(read_tag(buffer, byteorder, first_entry + i * entry_size, bigtiff)
+                    for i in range(num_entries))
+
+        # page layout is taken from the first page, every later page must match it
+        if info is None:
+            bits = tags.get(BITS_PER_SAMPLE, [1])[0]
+            kind = sample_kinds.get(tags.get(SAMPLE_FORMAT, [1])[0], 'u')
+            whole_bytes = bits in (8, 16, 32, 64)
+
+            # sub-byte and odd sample sizes have no numpy dtype, those files go to PIL
+            info = {'dtype': np.dtype(byteorder + kind + str(bits // 8)) if whole_bytes else None,
+                    'shape': (tags[IMAGE_LENGTH][0], tags[IMAGE_WIDTH][0]),
+                    'compression': tags.get(COMPRESSION, [1])[0],
+                    'simple': tags.get(SAMPLES_PER_PIXEL, [1])[0] == 1
+                    and TILE_WIDTH not in tags and whole_bytes}
+
+        pages.append((tags.get(STRIP_OFFSETS, []), tags.get(STRIP_BYTE_COUNTS, [])))
+
+        ifd = struct.unpack_from(byteorder + pointer, buffer,
+                                 first_entry + num_entries * entry_size)[0]
+
+    info['pages'] = pages
+
+    return info
+
+
+def stack_shape(path):
+    """
+    Returns: tuple (frames, lines, pixels) and numpy dtype of a tiff file without reading
+    any pixel data (None for sub-byte samples)
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+    """
+    info = index_pages(path)
+
+    return (len(info['pages']),) + info['shape'], info['dtype']
+
+
+def page_offsets(info):
+    """
+    Returns: 1D numpy array with the byte offset of each page, or None if any page's pixel
+    data is not stored uncompressed in one contiguous block
+
+    Parameter info: the page index of a tiff file
+    Precondition: info must be a dict returned by index_pages
+    """
+    if info['compression'] != 1 or not info['simple']:
+        return None
+
+    page_bytes = info['shape'][0] * info['shape'][1] * info['dtype'].itemsize
+
+    offsets = []
+    for strip_offsets, strip_counts in info['pages']:
+        # strips of a page have to follow each other with no gaps
+        if not strip_offsets or sum(strip_counts) != page_bytes:
+            return None
+        if any(strip_offsets[i] + strip_counts[i] != strip_offsets[i + 1]
+               for i in range(len(strip_offsets) - 1)):
+            return None
+        offsets.append(strip_offsets[0])
+
+    return np.array(offsets)
+
+
+def read_stack(path):
+    """
+    Returns: 3D numpy array (frames, lines, pixels) with the raw samples of a tiff file.
+    Uncompressed files with evenly spaced pages are returned as a read-only np.memmap view
+    without copying; everything else is decoded page by page.
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+    """
+    info = index_pages(path)
+    offsets = page_offsets(info)
+
+    # compressed or unusual layouts are decoded with PIL
+    if offsets is None:
+        return read_stack_pil(path)
+
+    return map_pages(path, offsets, info['shape'], info['dtype'])
+
+
+def map_pages(path, offsets, shape, dtype):
+    """
+    Returns: 3D numpy array (frames, lines, pixels) over a read-only memory map of pages
+    whose offsets are already known, e.g. from a session manifest. Evenly spaced pages are
+    one strided view without copying; others are gathered page by page.
+
+    Parameter path: pathname for the tiff file
+    Precondition: path must be a String
+
+    Parameter offsets: byte offset of each page's pixel data
+    Precondition: offsets must be a 1D numpy array of ints
+
+    Parameter shape: page shape (lines, pixels)
+    Precondition: shape must be a tuple of two ints
+
+    Parameter dtype: dtype of the samples, with byte order
+    Precondition: dtype must be a numpy dtype
+    """
+    return view_pages(np.memmap(path, dtype=np.uint8, mode='r'), offsets, shape, dtype)
+
+
+def view_pages(raw, offsets, shape, dtype):
+    """
+    Returns: 3D numpy array (frames, lines, pixels) over the bytes of a tiff file whose page
+    offsets are known, a strided view when the pages are evenly spaced and a gathered copy
+    otherwise
+
+    Parameter raw: every byte of the file, memory mapped or read into memory
+    Precondition: raw must be a 1D numpy array of uint8
+
+    Parameter offsets: byte offset of each page's pixel data
+    Precondition: offsets must be a 1D numpy array of ints
+
+    Parameter shape: page shape (lines, pixels)
+    Precondition: shape must be a tuple of two ints
+
+    Parameter dtype: dtype of the samples, with byte order
+    Precondition: dtype must be a numpy dtype
+    """
+    dtype = np.dtype(dtype)
+    lines, pixels = shape
+    row_bytes = pixels * dtype.itemsize
+
+    # distance between consecutive pages (IFDs may sit between them)
+    steps = np.diff(offsets)
+    page_stride = int(steps[0]) if steps.size else lines * row_bytes
+
+    # evenly spaced pages can be described by a single strided view over the file
+    if np.all(steps == page_stride) and page_stride > 0:
+        return np.ndarray(shape=(offsets.size, lines, pixels), dtype=dtype, buffer=raw,
+                          offset=int(offsets[0]), strides=(page_stride, row_bytes, dtype.itemsize))
+
+    # otherwise gather each page out of the buffer
+    return np.array([np.ndarray(shape=(lines, pixels), dtype=dtype, buffer=raw,
+                                offset=int(offset)) for offset in offsets])
+
+
+def read_stack_buffer(buffer):
+    """
+    Returns: 3D numpy array (frames, lines, pixels) with the raw samples of a tiff file that
+    has already been read into memory, viewed in place when the pages are uncompressed
+
+    Parameter buffer: every byte of the tiff file
+    Precondition: buffer must be a 1D numpy array of uint8
+    """
+    info = index_buffer(buffer)
+    offsets = page_offsets(info)
+
+    # compressed or unusual layouts are decoded with PIL from the bytes in memory
+    if offsets is None:
+        return read_stack_pil(io.BytesIO(buffer))
+
+    return view_pages(buffer, offsets, info['shape'], info['dtype'])
+
+
+def read_stack_pil(path):
+    """
+    Returns: 3D numpy array (frames, lines, pixels) decoded with PIL one page at a time
+
+    Parameter path: pathname for the tiff file, or the file itself already in memory
+    Precondition: path must be a String or a binary file object
+    """
+    # imported on first use, most files are mapped without PIL
+    from PIL import Image
+
+    with Image.open(path) as img:
+        # initialize list to hold frames
+        frames = []
+        # loop through every frame
+        for i in range(img.n_frames):
+            # go to right frame
+            img.seek(i)
+            frames.append(np.array(img))
+
+    return np.array(frames)
@@ -1,11 +1,27 @@
-import PySimpleGUI as sg
-import matplotlib
-import numpy as np
-import matplotlib.pyplot as plt
+import time
+
+# when startup began, to measure how long the window takes to appear
+startup_start = time.perf_counter()
 
-import PCA
-from SNLabBCI import TiffProcessor as tp, Grapher as g
+import os
+import json
+import threading
+import traceback
+import PySimpleGUI as sg
 import GUIHelper as ghelper
+import JobRunner as jr
+
+# analysis and plotting modules, imported on a background thread once the window is shown
+np = plt = tp = g = es = fe = fw = lv = ins = bl = None
+
+# set once the background import of the analysis and plotting modules has finished
+modules_ready = threading.Event()
+
+# traceback of the background import if it failed, else None
+import_error = None
+
+# file each startup appends its timings to (one json object per line)
+startup_log = os.path.join(os.path.expanduser('~'), '.snlab_startup.jsonl')
 
 # constants
 pixelps = 3.4 / 65536.0
@@ -31,211 +47,478 @@ channel_color = {0: 'Green', 1: 'Blue', 2: 'Gold', 3: 'Red'}
 # filepath to save all csv files to
 csv_path = '/Users/jonahbernard/Desktop/SN Lab/6.03.23/CSV Data'
 
-# change from MacOS backend to Tkinter
-matplotlib.use('TkAgg')
-
-# Define the layout of the GUI
-layout = [
-    [sg.Text("Tiff Folder Path:")],
-    [sg.Input(key="-TIFF_FOLDER_PATH-"), sg.FolderBrowse()],
-    [sg.Text("Metadata Folder Path:")],
-    [sg.Input(key="-METADATA_FOLDER_PATH-"), sg.FileBrowse()],
-    [sg.Text("Graph Title:")],
-    [sg.Input(key="-GRAPH_TITLE-", size=(80, 1))],
-    [(sg.Button('Average By Orientation', size=(50, 1))),
-     (sg.Button('Plot ', size=(20, 1)))],  # 1 space
-    [(sg.Button('Record Noise Baseline', size=(50, 1)))],
-    [(sg.Button('Average Across All Trials', size=(50, 1))),
-     (sg.Button('Plot  ', size=(20, 1)))],  # 2 spaces
-    [(sg.Button('Choose Trials', size=(50, 1))),
-     (sg.Button('Plot   ', size=(20, 1)))],  # 3 spaces
-    [(sg.Button('Subtract Noise From Dataset', size=(50, 1))),
-     (sg.Button('Plot    ', size=(20, 1)))],  # 4 spaces
-    [(sg.Button('Trial vs. Experiment', size=(50, 1))),
-     (sg.Button('Plot     ', size=(20, 1)))],  # 5 spaces
-    [(sg.Button('Standard Deviation', size=(50, 1))),
-     (sg.Button('Plot      ', size=(20, 1)))],  # 6 spaces
-    [(sg.Button('10 Trials Per Chart', size=(50, 1))),
-     (sg.Button('Plot       ', size=(20, 1)))],  # 7 spaces
-    [(sg.Button('Plot By Channel', size=(80, 1)))],
-    [(sg.Button('Run All', size=(80, 1)))],
-    [(sg.Button('Photon Count', size=(80, 1)))]
-]
-
-# Create the PySimpleGUI window
-sg.theme('DarkBlue3')
-window = sg.Window('Data Plotter', layout)
-
-# Create an event loop for the PySimpleGUI window
-while True:
-    event, values = window.read()
-    if event in (None, 'Exit'):
-        break
-
-    # plot data that is average across trials
-    if event == 'Average By Orientation':
-        type = 1
-
-        # process data
-        data = tp.average(values["-TIFF_FOLDER_PATH-"], values["-METADATA_FOLDER_PATH-"])
-
-    elif event == 'Plot ':
-        # Plot the selected datasets and channels
-        g.plot_data(data, type)
-
-    elif event == 'Average Across All Trials':
-        type = 2
-
-        # process data
-        data = tp.baseline(values["-TIFF_FOLDER_PATH-"], values["-METADATA_FOLDER_PATH-"])
-
-        # reshape data from 3D to 2D numpy array for saving
-        data = data.reshape(4, 5376)
-
-        # save processed data
-        np.savetxt(values["-GRAPH_TITLE-"] + ".csv", data, delimiter=",")
-
-    elif event == 'Plot  ':
-        # read in csv file with filename that matches graph title
-        data = np.genfromtxt(values["-GRAPH_TITLE-"] + ".csv", delimiter=',')
-
-        # Plot the selected datasets and channels
-        g.plot_data(data, type, values=values)
-
-    # plot data from single trial
-    elif event == 'Choose Trials':
-        type = 0
-
-        # list of which trials to plot and subtract one from each to make it zero-based
-        trials = np.array(ghelper.choose_trial()) - 1
-        trials = trials.tolist()
-
-        # process data and select the trials we want
-        data = tp.single_trial(trials, values["-TIFF_FOLDER_PATH-"],
-                               values["-METADATA_FOLDER_PATH-"])
-
-        # add one back for labeling
-        trials = np.array(trials) + 1
-        trials = trials.tolist()
-
-        # save processed data
-        # np.savetxt(values["-GRAPH_TITLE-"] + ".csv", data, delimiter=",")
-
-        # plot by trial
-    elif event == 'Plot   ':
-        g.plot_single_trial(data, trials)
-
-    elif event == 'Record Noise Baseline':
-        type = 2
-
-        # process data
-        data = tp.baseline(values["-TIFF_FOLDER_PATH-"], values["-METADATA_FOLDER_PATH-"])
-
-        # save baseline
-        data = data.reshape(4, 5376)
-        np.savetxt("baseline.csv", data, delimiter=",")
-
-    elif event == 'Subtract Noise From Dataset':
-        # set type
-        type = 2
-
-        # read in csv file with baseline data
-        baseline = np.genfromtxt('../baseline.csv', delimiter=',')
-
-        # read in csv file with new data
-        data = np.genfromtxt(values["-GRAPH_TITLE-"] + ".csv", delimiter=',')
-
-        # subtract baseline from new data
-        data = data - baseline
-
-        # save noise adjusted data
-        np.savetxt(values["-GRAPH_TITLE-"] + "_Noise_Adjusted.csv", data, delimiter=",")
-
-    elif event == 'Plot    ':
-        # read in csv file with filename that matches graph title
-        data = np.genfromtxt(values["-GRAPH_TITLE-"] + ".csv", delimiter=',')
-
-        # Plot the selected datasets and channels
-        g.plot_data(data, type, values)
-
-    elif event == 'Trial vs. Experiment':
-        # process data
-        data = tp.average_trials(values["-TIFF_FOLDER_PATH-"], values["-METADATA_FOLDER_PATH-"])
-
-    elif event == 'Plot     ':
-        # plot data
-        g.plot_trial_vs_experiment(data)
-
-    elif event == 'Standard Deviation':
-        # process data
-        data_average, data_std = tp.standard_deviation(values["-TIFF_FOLDER_PATH-"],
-                                                       values["-METADATA_FOLDER_PATH-"])
-
-        # plot standard deviation
-    elif event == "Plot      ":
-        # plot data
-        g.plot_std(data_average, data_std, values=values)
-
-    elif event == "10 Trials Per Chart":
-        # process data
-        data = tp.separate_trials(values["-TIFF_FOLDER_PATH-"],
-                                  values["-METADATA_FOLDER_PATH-"])
-
-        # plot and automatically save files
-    elif event == 'Plot       ':
-        # determine how many charts to create for the dataset (only works for multiples of 10)
-        num_charts = np.size(data, axis=0) // 10
-
-        # iterate through all trials
-        for i in range(num_charts):
-            # create trial index list for legend
-            trials = list(range(((i * 10) + 1), ((i + 1) * 10) + 1))
-            g.plot_single_trial(data[(i * 10):((i + 1) * 10)], trials, values=values)
-
-    elif event == 'Plot By Channel':
-        #g.plot_by_channel()
-         data = tp.histogramFrame(values["-TIFF_FOLDER_PATH-"],
-                                  values[
-                                      "-METADATA_FOLDER_PATH-"])
-
-    elif event == 'Run All':
-        trial_data, data_average, std_data, baseline_data = tp.run_all(values["-TIFF_FOLDER_PATH-"],
-                                                                       values[
-                                                                           "-METADATA_FOLDER_PATH-"])
-        # plot data
-        g.plot_std(data_average, std_data, values=values)
-        g.plot_data(baseline_data, values=values, type=2)
-
-        # determine how many charts to create for the dataset (only works for multiples of 10)
-        num_charts = np.size(trial_data, axis=0) // 10
-
-        # iterate through all trials
-        for i in range(num_charts):
-            # create trial index list for legend
-            trials = list(range(((i * 10) + 1), ((i + 1) * 10) + 1))
-            g.plot_single_trial(trial_data[(i * 10):((i + 1) * 10)], trials, values=values)
-
-    elif event == 'Photon Count':
-        # process data
-        data = tp.photon_count(values["-TIFF_FOLDER_PATH-"],
-                          values[
-                              "-METADATA_FOLDER_PATH-"])
-
-
-        # plot data
-        #g.plot_data(data, 2, values=values)
-
-    elif event == 'PCA':
-        # process data
-        data = tp.pca(values["-TIFF_FOLDER_PATH-"],
-                      values[
-                          "-METADATA_FOLDER_PATH-"])
-
-        PCA.my_pca(data[0])
-
-
-    elif event == 'Close':
-        plt.close('all')
-
-# Close the PySimpleGUI window
-window.close()
+# the job whose result each Plot button draws; a button is enabled once its job has finished
+plot_jobs = {'Plot ': 'Average By Orientation', 'Plot  ': 'Average Across All Trials',
+             'Plot   ': 'Choose Trials', 'Plot    ': 'Subtract Noise From Dataset',
+             'Plot     ': 'Trial vs. Experiment', 'Plot      ': 'Standard Deviation',
+             'Plot       ': '10 Trials Per Chart'}
+
+# the Plot button of each job
+plot_buttons = {job: button for button, job in plot_jobs.items()}
+
+
+def import_analysis_modules(window, window_seconds):
+    """
+    Imports numpy, matplotlib and the SNLabBCI modules off the GUI thread, starts the
+    figure export workers and records how long startup took. If the import fails, the
+    error is sent to the window as '-IMPORT_ERROR-'; modules_ready is set either way so
+    the event loop never waits forever.
+
+    Parameter window: the window to report an import error to
+    Precondition: window must be a PySimpleGUI Window
+
+    Parameter window_seconds: seconds from startup until the window was shown
+    Precondition: window_seconds must be a float
+    """
+    global np, plt, tp, g, es, fe, fw, lv, ins, bl, import_error
+
+    try:
+        # change from MacOS backend to Tkinter
+        import matplotlib
+        matplotlib.use('TkAgg')
+
+        import numpy
+        import matplotlib.pyplot
+        from SNLabBCI import TiffProcessor, Grapher, ExperimentStore, FigureExport, FolderWatch
+        from SNLabBCI import LiveView, BaselineLibrary
+
+        np, plt = numpy, matplotlib.pyplot
+        tp, g, es, fe = TiffProcessor, Grapher, ExperimentStore, FigureExport
+        fw, lv, bl = FolderWatch, LiveView, BaselineLibrary
+
+        # the same Instrumentation module the pipeline records its stages in
+        ins = TiffProcessor.ins
+    except Exception:
+        import_error = traceback.format_exc()
+        window.write_event_value('-IMPORT_ERROR-', import_error)
+        return
+    finally:
+        modules_ready.set()
+
+    modules_seconds = time.perf_counter() - startup_start
+    print('window shown in %.2f s, analysis modules ready in %.2f s'
+          % (window_seconds, modules_seconds))
+    with open(startup_log, 'a') as f:
+        f.write(json.dumps({'time': time.time(), 'window_s': window_seconds,
+                            'modules_s': modules_seconds}) + '\n')
+
+    # export workers pay for their own imports now instead of on the first export
+    fe.prewarm()
+
+
+def main():
+    """
+    Shows the window and runs its event loop until it is closed. Kept out of the module top
+    level so processes spawned by the figure export pool can import this script without
+    opening windows of their own.
+    """
+    # Define the layout of the GUI
+    layout = [
+        [sg.Text("Tiff Folder Path:")],
+        [sg.Input(key="-TIFF_FOLDER_PATH-"), sg.FolderBrowse()],
+        [sg.Text("Metadata Folder Path:")],
+        [sg.Input(key="-METADATA_FOLDER_PATH-"), sg.FileBrowse()],
+        [sg.Text("Graph Title:")],
+        [sg.Input(key="-GRAPH_TITLE-", size=(80, 1))],
+        [sg.Checkbox('Also export CSV', key="-EXPORT_CSV-"),
+         sg.Checkbox('Profile stages', key="-PROFILE-"),
+         sg.Checkbox('Single precision (float32)', key="-FLOAT32-")],
+        [(sg.Button('Average By Orientation', size=(50, 1))),
+         (sg.Button('Plot ', size=(20, 1), disabled=True))],  # 1 space
+        [(sg.Button('Record Noise Baseline', size=(50, 1)))],
+        [sg.Text("Rig:"), sg.Input(key="-NOISE_RIG-", size=(12, 1)),
+         sg.Text("Objective:"), sg.Input(key="-NOISE_OBJECTIVE-", size=(12, 1)),
+         sg.Text("Date:"), sg.Input(time.strftime('%Y-%m-%d'), key="-NOISE_DATE-", size=(12, 1))],
+        [(sg.Button('Average Across All Trials', size=(50, 1))),
+         (sg.Button('Plot  ', size=(20, 1), disabled=True))],  # 2 spaces
+        [(sg.Button('Choose Trials', size=(50, 1))),
+         (sg.Button('Plot   ', size=(20, 1), disabled=True))],  # 3 spaces
+        [(sg.Button('Subtract Noise From Dataset', size=(50, 1))),
+         (sg.Button('Plot    ', size=(20, 1), disabled=True))],  # 4 spaces
+        [(sg.Button('Trial vs. Experiment', size=(50, 1))),
+         (sg.Button('Plot     ', size=(20, 1), disabled=True))],  # 5 spaces
+        [(sg.Button('Standard Deviation', size=(50, 1))),
+         (sg.Button('Plot      ', size=(20, 1), disabled=True))],  # 6 spaces
+        [(sg.Button('10 Trials Per Chart', size=(50, 1))),
+         (sg.Button('Plot       ', size=(20, 1), disabled=True))],  # 7 spaces
+        [(sg.Button('Plot By Channel', size=(80, 1)))],
+        [(sg.Button('Run All', size=(80, 1)))],
+        [(sg.Button('Photon Count', size=(80, 1)))],
+        [(sg.Button('PCA', size=(50, 1))), sg.Text("Components:"),
+         sg.Input("3", key="-PCA_COMPONENTS-", size=(4, 1)),
+         sg.Combo(['incremental', 'randomized'], default_value='incremental',
+                  key="-PCA_METHOD-", readonly=True)],
+        [(sg.Button('Watch Folder', size=(50, 1))),
+         (sg.Button('Stop Watching', size=(20, 1)))],
+        [sg.ProgressBar(100, orientation='h', size=(50, 20), key="-PROGRESS-"),
+         sg.Button('Cancel', size=(10, 1))],
+        [sg.Text("", key="-STATUS-", size=(80, 1))]
+    ]
+
+    # Create the PySimpleGUI window and show it before anything heavy is imported
+    sg.theme('DarkBlue3')
+    window = sg.Window('Data Plotter', layout, finalize=True)
+
+    threading.Thread(target=import_analysis_modules,
+                     args=(window, time.perf_counter() - startup_start), daemon=True).start()
+
+    # run processing on a background thread so the window stays responsive
+    jr.start(window)
+
+    # set to end a folder watch and keep the results gathered so far
+    stop_watching = threading.Event()
+
+    # live view of the watched session, opened when its first trial arrives
+    live_view = None
+
+    # latest plottable result of each job, with the GUI values it was submitted with
+    results = {}
+
+    # Create an event loop for the PySimpleGUI window
+    while True:
+        # while a live view is open, wake up regularly to draw updates the frame rate held back
+        event, values = window.read(timeout=None if live_view is None else 1000 // lv.target_fps)
+        if event in (None, 'Exit'):
+            break
+
+        # a button pressed right after startup waits for the analysis modules
+        if event != sg.TIMEOUT_EVENT:
+            modules_ready.wait()
+
+        # nothing can be processed or plotted without the analysis modules
+        if import_error is not None:
+            if event == '-IMPORT_ERROR-':
+                print(import_error)
+            window["-STATUS-"].update("Analysis modules failed to load: "
+                                      + import_error.strip().splitlines()[-1])
+            continue
+
+        # a Plot button only draws a result its job has already returned
+        if event in plot_jobs and plot_jobs[event] not in results:
+            window["-STATUS-"].update("Run " + plot_jobs[event] + " before plotting it")
+
+        # processing buttons only queue a job, its result comes back as '-JOB_DONE-'
+        elif event == 'Average By Orientation':
+            # process data
+            jr.submit(event, tp.average, (values["-TIFF_FOLDER_PATH-"],
+                                          values["-METADATA_FOLDER_PATH-"]), values)
+
+        elif event == 'Plot ':
+            data, job_values = results[plot_jobs[event]]
+
+            # Plot the selected datasets and channels
+            g.plot_data(data, 1)
+
+        elif event == 'Average Across All Trials':
+            # process data
+            jr.submit(event, tp.baseline, (values["-TIFF_FOLDER_PATH-"],
+                                           values["-METADATA_FOLDER_PATH-"]), values)
+
+        elif event == 'Plot  ':
+            data, job_values = results[plot_jobs[event]]
+
+            # Plot the selected datasets and channels
+            g.plot_data(data, 2, values=job_values)
+
+        # plot data from single trial
+        elif event == 'Choose Trials':
+            # list of which trials to plot and subtract one from each to make it zero-based
+            trials = np.array(ghelper.choose_trial()) - 1
+            trials = trials.tolist()
+
+            # process data and select the trials we want; the job keeps the one-based trial
+            # numbers for labeling
+            jr.submit(event, tp.single_trial, (trials, values["-TIFF_FOLDER_PATH-"],
+                                               values["-METADATA_FOLDER_PATH-"]),
+                      dict(values, **{"-TRIALS-": (np.array(trials) + 1).tolist()}))
+
+            # plot by trial
+        elif event == 'Plot   ':
+            data, job_values = results[plot_jobs[event]]
+            g.plot_single_trial(data, job_values["-TRIALS-"], values=job_values)
+
+        elif event == 'Record Noise Baseline':
+            # check the library key before processing, the baseline is stored under it when done
+            try:
+                bl.make_key(values["-NOISE_RIG-"], values["-NOISE_OBJECTIVE-"],
+                            values["-NOISE_DATE-"])
+            except ValueError as error:
+                window["-STATUS-"].update(event + ": " + str(error))
+                continue
+
+            # process data
+            jr.submit(event, tp.baseline, (values["-TIFF_FOLDER_PATH-"],
+                                           values["-METADATA_FOLDER_PATH-"]), values)
+
+        elif event == 'Subtract Noise From Dataset':
+            # latest baseline of the rig and objective recorded on or before the session date
+            try:
+                entry = bl.find(values["-NOISE_RIG-"], values["-NOISE_OBJECTIVE-"],
+                                values["-NOISE_DATE-"])
+            except ValueError as error:
+                window["-STATUS-"].update(event + ": " + str(error))
+                continue
+            if entry is None:
+                window["-STATUS-"].update(event + ": no noise baseline for this rig and objective")
+                continue
+
+            # subtract the baseline while the trials are processed, in a single pass
+            jr.submit(event, tp.noise_adjusted, (values["-TIFF_FOLDER_PATH-"],
+                                                 values["-METADATA_FOLDER_PATH-"], bl.read(entry)),
+                      values)
+
+        elif event == 'Plot    ':
+            data, job_values = results[plot_jobs[event]]
+
+            # Plot the selected datasets and channels
+            g.plot_data(data, 2, job_values)
+
+        elif event == 'Trial vs. Experiment':
+            # process data
+            jr.submit(event, tp.average_trials, (values["-TIFF_FOLDER_PATH-"],
+                                                 values["-METADATA_FOLDER_PATH-"]), values)
+
+        elif event == 'Plot     ':
+            data, job_values = results[plot_jobs[event]]
+
+            # plot data
+            g.plot_trial_vs_experiment(data)
+
+        elif event == 'Standard Deviation':
+            # process data
+            jr.submit(event, tp.standard_deviation, (values["-TIFF_FOLDER_PATH-"],
+                                                     values["-METADATA_FOLDER_PATH-"]), values)
+
+            # plot standard deviation
+        elif event == "Plot      ":
+            (data_average, data_std), job_values = results[plot_jobs[event]]
+
+            # plot data
+            g.plot_std(data_average, data_std, values=job_values)
+
+        elif event == "10 Trials Per Chart":
+            # process data
+            jr.submit(event, tp.separate_trials, (values["-TIFF_FOLDER_PATH-"],
+                                                  values["-METADATA_FOLDER_PATH-"]), values)
+
+            # plot and automatically save files
+        elif event == 'Plot       ':
+            data, job_values = results[plot_jobs[event]]
+
+            # build and save one chart per 10 trials on worker processes, off the GUI thread; not
+            # profiled, its work runs in processes that record nothing
+            jr.submit('Export Charts', fe.export_trial_charts, (data, job_values),
+                      dict(job_values, **{"-PROFILE-": False}))
+
+        elif event == 'Plot By Channel':
+            #g.plot_by_channel()
+            # process data, the histogram is drawn once the frame is loaded
+            jr.submit(event, tp.first_frame, (values["-TIFF_FOLDER_PATH-"],
+                                              values["-METADATA_FOLDER_PATH-"]), values)
+
+        elif event == 'Run All':
+            # process data
+            jr.submit(event, tp.run_all, (values["-TIFF_FOLDER_PATH-"],
+                                          values["-METADATA_FOLDER_PATH-"]), values)
+
+        elif event == 'Photon Count':
+            # process data
+            jr.submit(event, tp.photon_count, (values["-TIFF_FOLDER_PATH-"],
+                                               values["-METADATA_FOLDER_PATH-"]), values)
+
+        elif event == 'PCA':
+            # check the number of components before processing
+            try:
+                components = int(values["-PCA_COMPONENTS-"])
+            except ValueError:
+                components = 0
+            if components < 1:
+                window["-STATUS-"].update(event + ": components must be a whole number of at least"
+                                          " 1, not " + repr(values["-PCA_COMPONENTS-"]))
+                continue
+
+            # process data
+            jr.submit(event, tp.pca, (values["-TIFF_FOLDER_PATH-"],
+                                      values["-METADATA_FOLDER_PATH-"],
+                                      components, values["-PCA_METHOD-"]),
+                      values)
+
+        elif event == 'Watch Folder':
+            stop_watching.clear()
+
+            # ingest trials while the microscope writes them, announcing each one to the window;
+            # progress goes straight to the job runner so the bar moves and Cancel stops it; the
+            # dtype is passed in because FolderWatch uses its own copy of TiffProcessor
+            jr.submit(event, fw.watch,
+                      (values["-TIFF_FOLDER_PATH-"], values["-METADATA_FOLDER_PATH-"],
+                       lambda update: window.write_event_value('-LIVE_TRIAL-', update),
+                       stop_watching, jr.report_progress,
+                       np.float32 if values["-FLOAT32-"] else np.float64), values)
+
+        elif event == 'Stop Watching':
+            stop_watching.set()
+
+        elif event == '-LIVE_TRIAL-':
+            update = values[event]
+            window["-STATUS-"].update("Watch Folder: trial " + str(update['trial'] + 1) + " ("
+                                      + update['name'] + ") ingested")
+
+            # reopen the live view if it was closed
+            if live_view is None or not lv.is_open(live_view):
+                live_view = lv.create(values["-GRAPH_TITLE-"] + ' (live)')
+            lv.update(live_view, update['average'], update['lines'])
+
+        elif event == sg.TIMEOUT_EVENT:
+            if lv.is_open(live_view):
+                lv.flush(live_view)
+            else:
+                live_view = None
+
+        elif event == 'Cancel':
+            # stop the running job after the file it is ingesting
+            jr.cancel()
+
+        elif event == '-JOB_STARTED-':
+            job_event, job_values = values[event]
+            window["-PROGRESS-"].update(current_count=0)
+            window["-STATUS-"].update(job_event + ": " + job_values["-TIFF_FOLDER_PATH-"] + " ("
+                                      + str(jr.pending()) + " queued)")
+
+        elif event == '-JOB_PROGRESS-':
+            done, total = values[event]
+            window["-PROGRESS-"].update(current_count=done, max=total)
+
+        elif event == '-JOB_CANCELLED-':
+            job_event, job_values = values[event]
+            window["-STATUS-"].update(job_event + " cancelled")
+
+        elif event == '-JOB_ERROR-':
+            job_event, error, job_values = values[event]
+            print(error)
+            window["-STATUS-"].update(job_event + " failed: " + error.strip().splitlines()[-1])
+
+        elif event == '-JOB_DONE-':
+            # finish the job on the GUI thread with the values it was submitted with
+            job_event, result, job_values, profile = values[event]
+            window["-STATUS-"].update(job_event + " done (" + str(jr.pending()) + " queued)")
+
+            if job_event in ('Average By Orientation', 'Choose Trials', 'Trial vs. Experiment',
+                             '10 Trials Per Chart'):
+                data = result
+
+                if job_event == '10 Trials Per Chart':
+                    # save processed data
+                    es.add(job_values["-GRAPH_TITLE-"], {'trials': data})
+
+            elif job_event == 'Average Across All Trials':
+                # reshape data from 3D to 2D numpy array for saving
+                data = result.reshape(4, 5376)
+
+                # save processed data to the experiment store
+                es.add(job_values["-GRAPH_TITLE-"], {'averages': data})
+                if job_values["-EXPORT_CSV-"]:
+                    np.savetxt(job_values["-GRAPH_TITLE-"] + ".csv", data, delimiter=",")
+
+            elif job_event == 'Record Noise Baseline':
+                # store the baseline in the library under its rig, objective and date
+                data = result.reshape(4, -1)
+                entry = bl.record(data, job_values["-NOISE_RIG-"], job_values["-NOISE_OBJECTIVE-"],
+                                  job_values["-NOISE_DATE-"], job_values["-TIFF_FOLDER_PATH-"])
+                window["-STATUS-"].update(job_event + ": saved " + entry['file'])
+                if job_values["-EXPORT_CSV-"]:
+                    np.savetxt("baseline.csv", data, delimiter=",")
+
+            elif job_event == 'Subtract Noise From Dataset':
+                data = result['average'].reshape(4, -1)
+
+                # save noise adjusted data
+                es.add(job_values["-GRAPH_TITLE-"],
+                       {'noise_adjusted': data,
+                        'noise_adjusted_std': result['std'].reshape(4, -1),
+                        'noise_adjusted_trials': result['lines'],
+                        'noise_adjusted_photon_counts': result['photon_counts']})
+                if job_values["-EXPORT_CSV-"]:
+                    np.savetxt(job_values["-GRAPH_TITLE-"] + "_Noise_Adjusted.csv", data,
+                               delimiter=",")
+
+            elif job_event == 'Standard Deviation':
+                data = result
+                data_average, data_std = result
+
+                # save processed data
+                es.add(job_values["-GRAPH_TITLE-"], {'averages': data_average.reshape(4, 5376),
+                                                     'std': data_std.reshape(4, 5376)})
+
+            elif job_event == 'Run All':
+                trial_data, data_average, std_data, baseline_data = result
+
+                # save processed data
+                es.add(job_values["-GRAPH_TITLE-"], {'trials': trial_data,
+                                                     'averages': baseline_data.reshape(4, 5376),
+                                                     'std': std_data.reshape(4, 5376)})
+
+                # plot data
+                g.plot_std(data_average, std_data, values=job_values)
+                g.plot_data(baseline_data, values=job_values, type=2)
+
+                # build and save one chart per 10 trials on worker processes, off the GUI thread;
+                # not profiled, its work runs in processes that record nothing
+                jr.submit('Export Charts', fe.export_trial_charts, (trial_data, job_values),
+                          dict(job_values, **{"-PROFILE-": False}))
+
+            elif job_event == 'Watch Folder':
+                # save the orientations that received trials
+                live = {}
+                for i, (average, std, photons) in enumerate(zip(result['averages'], result['std'],
+                                                                result['photon_counts'])):
+                    if average is not None:
+                        live['averages_' + str(i)] = average.reshape(4, -1)
+                        live['std_' + str(i)] = std.reshape(4, -1)
+                        live['photon_counts_' + str(i)] = photons
+                es.add(job_values["-GRAPH_TITLE-"], live)
+
+            elif job_event == 'Plot By Channel':
+                # plot data
+                g.plot_frame_histogram(result)
+
+            elif job_event == 'Photon Count':
+                data = result
+
+                # save processed data
+                es.add(job_values["-GRAPH_TITLE-"], {'photon_counts': data})
+
+                # plot data
+                #g.plot_data(data, 2, values=values)
+
+            elif job_event == 'PCA':
+                # save loadings and per-trial scores of every channel
+                es.add(job_values["-GRAPH_TITLE-"], {'pca_' + name: array
+                                                     for name, array in result.items()})
+                window["-STATUS-"].update("PCA done: explained variance by channel "
+                                          + str(np.round(result['explained_variance_ratio']
+                                                         .sum(axis=1), 3).tolist()))
+
+            # keep the result its Plot button draws and enable the button
+            if job_event in plot_buttons:
+                results[job_event] = (data, job_values)
+                window[plot_buttons[job_event]].update(disabled=False)
+
+            if profile is not None:
+                # the stages the worker recorded while it ran the job
+                ins.write_report(job_values["-GRAPH_TITLE-"] + "_profile.json", profile)
+                ins.write_chrome_trace(job_values["-GRAPH_TITLE-"] + "_trace.json", profile)
+                window["-STATUS-"].update(job_event + ": " + ins.summary(records=profile))
+
+        elif event == 'Close':
+            plt.close('all')
+
+    # Stop the worker thread and export workers and close the PySimpleGUI window
+    jr.cancel()
+    jr.stop()
+    if fe is not None:
+        fe.shutdown()
+    window.close()
+
+
+if __name__ == '__main__':
+    main()
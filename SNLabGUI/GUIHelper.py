@@ -5,13 +5,13 @@ def choose_datasets():
     """
     Returns the datasets to plot when plotting by channel
     """
-    layout_choose_datasets = [[sg.Text("csv file 1:")],
+    layout_choose_datasets = [[sg.Text("data file 1 (.npz or .csv):")],
                               [sg.Input(key="-1_FOLDER_PATH-"), sg.FileBrowse()],
-                              [sg.Text("csv file 2:")],
+                              [sg.Text("data file 2 (.npz or .csv):")],
                               [sg.Input(key="-2_FOLDER_PATH-"), sg.FileBrowse()],
-                              [sg.Text("csv file 3:")],
+                              [sg.Text("data file 3 (.npz or .csv):")],
                               [sg.Input(key="-3_FOLDER_PATH-"), sg.FileBrowse()],
-                              [sg.Text("csv file 4:")],
+                              [sg.Text("data file 4 (.npz or .csv):")],
                               [sg.Input(key="-4_FOLDER_PATH-"), sg.FileBrowse()],
                               [sg.Button('Finish', size=(10, 1))]]
 
@@ -0,0 +1,141 @@
+import queue
+import threading
+import traceback
+
+# jobs waiting to run: (event name, function, arguments, GUI values when submitted)
+jobs = queue.Queue()
+
+# set to ask the running job to stop at its next progress report
+cancel_requested = threading.Event()
+
+# window that receives '-JOB_PROGRESS-', '-JOB_DONE-', '-JOB_CANCELLED-' and '-JOB_ERROR-'
+window = None
+
+# thread that runs the jobs one after another
+worker = None
+
+
+class Cancelled(Exception):
+    """
+    Raised inside a running job when the user presses Cancel
+    """
+
+
+def start(gui_window):
+    """
+    Starts the background worker thread that runs submitted jobs
+
+    Parameter gui_window: the window to send job events to
+    Precondition: gui_window must be a PySimpleGUI Window
+    """
+    global window, worker
+
+    window = gui_window
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+
+
+def submit(name, function, args, values):
+    """
+    Queues a processing job; it runs after any job submitted before it
+
+    Parameter name: the GUI event that created the job, sent back when it finishes
+    Precondition: name must be a String
+
+    Parameter function: the processing function to run
+    Precondition: function must be callable
+
+    Parameter args: arguments for the function
+    Precondition: args must be a tuple
+
+    Parameter values: the GUI values at submission, sent back when the job finishes
+    Precondition: values must be a dict
+    """
+    jobs.put((name, function, args, dict(values)))
+
+
+def pending():
+    """
+    Returns: the number of jobs waiting to run
+    """
+    return jobs.qsize()
+
+
+def cancel():
+    """
+    Asks the running job to stop; it stops after the trial it is currently ingesting
+    """
+    cancel_requested.set()
+
+
+def stop():
+    """
+    Stops the worker thread once the jobs already queued have run
+    """
+    jobs.put(None)
+
+
+def report_progress(done, total):
+    """
+    Progress callback for TiffProcessor: forwards per-file progress to the window and
+    stops the job if Cancel was pressed
+
+    Parameter done: number of files ingested so far
+    Precondition: done must be an int
+
+    Parameter total: number of files in the session
+    Precondition: total must be an int
+    """
+    if cancel_requested.is_set():
+        raise Cancelled()
+
+    window.write_event_value('-JOB_PROGRESS-', (done, total))
+
+
+def run():
+    """
+    Worker thread loop: runs queued jobs in order and sends the result of each to the window,
+    with the stages it recorded if its values ask for profiling (else None)
+    """
+    # imported on the worker thread so the window does not wait for them
+    from SNLabBCI import TiffProcessor as tp
+
+    # the pipeline modules import each other by their plain names, so the package's own
+    # Instrumentation would be a second copy; stages are recorded in the one tp uses
+    ins = tp.ins
+
+    tp.progress_callback = report_progress
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+
+        name, function, args, values = job
+        cancel_requested.clear()
+
+        # single precision halves the memory of the trials, within float32 rounding of the
+        # float64 results
+        tp.working_dtype = tp.np.float32 if values.get("-FLOAT32-") else tp.np.float64
+
+        # record stages when asked to
+        profile = None
+        if values.get("-PROFILE-"):
+            ins.start()
+        window.write_event_value('-JOB_STARTED-', (name, values))
+
+        try:
+            try:
+                result = function(*args)
+            finally:
+                # stop and copy the records here, before the next job's start clears them;
+                # the GUI writes the copy it receives with the result
+                if values.get("-PROFILE-"):
+                    ins.stop()
+                    profile = list(ins.events)
+        except Cancelled:
+            window.write_event_value('-JOB_CANCELLED-', (name, values))
+        except Exception:
+            window.write_event_value('-JOB_ERROR-', (name, traceback.format_exc(), values))
+        else:
+            window.write_event_value('-JOB_DONE-', (name, result, values, profile))
@@ -0,0 +1,33 @@
+"""
+Trials of a watched folder are numbered like list_tiffs numbers them, whatever order they
+finish in.
+"""
+import os
+import pytest
+import Benchmark as bm
+import FolderWatch as fw
+import SessionManifest as sm
+
+
+@pytest.fixture(scope='module')
+def session(tmp_path_factory):
+    """
+    Returns: tuple of the tiff folder and metadata pathname of a small synthetic session
+    """
+    return bm.generate_session(str(tmp_path_factory.mktemp('session')), num_trials=6,
+                               num_frames=2, lines=8, pixels=16)
+
+
+def test_late_trial_keeps_its_index(session):
+    tiff_dir, metadata_dir = session
+    names = sorted((name for name in os.listdir(tiff_dir) if '.tif' in name),
+                   key=sm.natural_key)
+    state = fw.create(tiff_dir, metadata_dir)
+
+    # the first trial finishes last
+    updates = [fw.ingest(state, name) for name in names[1:] + names[:1]]
+
+    for update in updates:
+        index = names.index(update['name'])
+        assert update['trial'] == index
+        assert update['group'] == state['groups'][index]
@@ -0,0 +1,77 @@
+"""
+float32 processing must stay within float32 rounding of the float64 results.
+"""
+import numpy as np
+import pytest
+import ArrayCache as ac
+import Benchmark as bm
+import FolderWatch as fw
+import TiffProcessor as tp
+
+# largest difference allowed between float32 and float64 results; normalized values lie in
+# [0, 1], where float32 resolves about 6e-8
+tolerance = 1e-6
+
+
+@pytest.fixture(scope='module')
+def session(tmp_path_factory):
+    """
+    Returns: tuple of the tiff folder and metadata pathname of a small synthetic session
+    """
+    return bm.generate_session(str(tmp_path_factory.mktemp('session')), num_trials=8,
+                               num_frames=6, lines=32, pixels=48)
+
+
+@pytest.fixture(autouse=True)
+def no_cache(monkeypatch):
+    """
+    Processes from the raw files in every test
+    """
+    monkeypatch.setattr(ac, 'enabled', False)
+
+
+def test_normalized_data(session):
+    tiff_dir, metadata_dir = session
+
+    single = tp.tif_processor_run(tiff_dir, metadata_dir, dtype=np.float32)
+    double = tp.tif_processor_run(tiff_dir, metadata_dir, dtype=np.float64)
+
+    assert single.dtype == np.float32
+    assert np.max(np.abs(single - double)) <= tolerance
+
+
+def test_line_means(session):
+    tiff_dir, metadata_dir = session
+
+    single = tp.tif_processor_run(tiff_dir, metadata_dir, average_lines=True, dtype=np.float32)
+    double = tp.tif_processor_run(tiff_dir, metadata_dir, average_lines=True, dtype=np.float64)
+
+    assert single.dtype == np.float32
+    assert np.max(np.abs(single - double)) <= tolerance
+
+
+def test_mean_and_std(session, monkeypatch):
+    tiff_dir, metadata_dir = session
+
+    monkeypatch.setattr(tp, 'working_dtype', np.float32)
+    single_mean, single_std = tp.standard_deviation(tiff_dir, metadata_dir)
+    monkeypatch.setattr(tp, 'working_dtype', np.float64)
+    double_mean, double_std = tp.standard_deviation(tiff_dir, metadata_dir)
+
+    assert single_mean.dtype == np.float32 and single_std.dtype == np.float32
+    assert np.max(np.abs(single_mean - double_mean)) <= tolerance
+    assert np.max(np.abs(single_std - double_std)) <= tolerance
+
+
+def test_watched_folder(session, monkeypatch):
+    tiff_dir, metadata_dir = session
+    monkeypatch.setattr(fw, 'poll_interval', 0)
+    updates = []
+
+    single = fw.watch(tiff_dir, metadata_dir, updates.append,
+                      progress=lambda done, total: None, dtype=np.float32)
+    double = fw.watch(tiff_dir, metadata_dir, progress=lambda done, total: None,
+                      dtype=np.float64)
+
+    assert all(update['lines'].dtype == np.float32 for update in updates)
+    assert np.max(np.abs(single['average'] - double['average'])) <= tolerance